@@ -0,0 +1,31 @@
+"""Trigram song search indexes
+
+Revision ID: 5c2e9a7b1f4d
+Revises: 38f8d56212d8
+Create Date: 2024-11-20 18:32:47.513209
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5c2e9a7b1f4d'
+down_revision: Union[str, None] = '38f8d56212d8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index('ix_songs_normalized_title_trgm', 'songs', ['normalized_title'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'normalized_title': 'gin_trgm_ops'})
+    op.create_index('ix_songs_artist_trgm', 'songs', ['artist'], unique=False,
+                    postgresql_using='gin', postgresql_ops={'artist': 'gin_trgm_ops'})
+
+
+def downgrade() -> None:
+    op.drop_index('ix_songs_artist_trgm', table_name='songs')
+    op.drop_index('ix_songs_normalized_title_trgm', table_name='songs')
@@ -0,0 +1,39 @@
+"""Playlist description filter indexes and song sample key
+
+Revision ID: 9e4b7d2a6c31
+Revises: 5c2e9a7b1f4d
+Create Date: 2024-11-21 14:07:12.886430
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9e4b7d2a6c31'
+down_revision: Union[str, None] = '5c2e9a7b1f4d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # random() is volatile, so every existing row gets its own sample key
+    op.add_column('songs', sa.Column('sample_key', sa.Float(), server_default=sa.text('random()'), nullable=False))
+    op.create_index('ix_songs_sample_key', 'songs', ['sample_key'], unique=False)
+    op.create_index('ix_songs_energy', 'songs', ['energy'], unique=False)
+    op.create_index('ix_songs_valence', 'songs', ['valence'], unique=False)
+    op.create_index('ix_songs_danceability', 'songs', ['danceability'], unique=False)
+    op.create_index('ix_songs_tempo', 'songs', ['tempo'], unique=False)
+    op.create_index('ix_songs_instrumentalness', 'songs', ['instrumentalness'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_songs_instrumentalness', table_name='songs')
+    op.drop_index('ix_songs_tempo', table_name='songs')
+    op.drop_index('ix_songs_danceability', table_name='songs')
+    op.drop_index('ix_songs_valence', table_name='songs')
+    op.drop_index('ix_songs_energy', table_name='songs')
+    op.drop_index('ix_songs_sample_key', table_name='songs')
+    op.drop_column('songs', 'sample_key')
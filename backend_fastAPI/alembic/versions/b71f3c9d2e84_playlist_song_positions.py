@@ -0,0 +1,34 @@
+"""Playlist song positions
+
+Revision ID: b71f3c9d2e84
+Revises: 9e4b7d2a6c31
+Create Date: 2024-11-22 10:41:53.204117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b71f3c9d2e84'
+down_revision: Union[str, None] = '9e4b7d2a6c31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.execute(sa.schema.CreateSequence(sa.Sequence('playlist_songs_position_seq')))
+    # nextval() is volatile, so every existing membership row gets its own position
+    op.add_column('playlist_songs', sa.Column(
+        'position', sa.BigInteger(), nullable=False,
+        server_default=sa.text("nextval('playlist_songs_position_seq') * 1024"),
+    ))
+    op.create_index('ix_playlist_songs_playlist_id_position', 'playlist_songs', ['playlist_id', 'position'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_playlist_songs_playlist_id_position', table_name='playlist_songs')
+    op.drop_column('playlist_songs', 'position')
+    op.execute(sa.schema.DropSequence(sa.Sequence('playlist_songs_position_seq')))
@@ -0,0 +1,26 @@
+"""Playlist version
+
+Revision ID: c4e8a1f05b37
+Revises: b71f3c9d2e84
+Create Date: 2024-11-25 09:12:37.518402
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e8a1f05b37'
+down_revision: Union[str, None] = 'b71f3c9d2e84'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('playlists', sa.Column('version', sa.BigInteger(), nullable=False, server_default=sa.text('0')))
+
+
+def downgrade() -> None:
+    op.drop_column('playlists', 'version')
@@ -0,0 +1,6 @@
+from .song_catalog import *
+from .description_rules import *
+from .acoustic_index import *
+from .artist_dictionary import *
+from .ngram_index import *
+from .entity_linker import *
\ No newline at end of file
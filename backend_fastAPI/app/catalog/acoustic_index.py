@@ -0,0 +1,219 @@
+import os
+import threading
+from typing import Optional, Tuple
+
+import numpy as np
+
+from .song_catalog import SongCatalog
+
+# Features spanning the acoustic vector space; `key` is left out since pitch classes have no meaningful distance
+VECTOR_FEATURES: Tuple[str, ...] = (
+    "acousticness", "danceability", "energy", "instrumentalness", "liveness",
+    "loudness", "mode", "speechiness", "valence", "tempo",
+)
+
+# Catalogs up to this size are searched exactly, larger ones through the inverted file (IVF) index
+EXACT_SEARCH_MAX_ROWS = 250_000
+SEARCH_BLOCK_SIZE = 65_536
+
+# IVF parameters: number of coarse clusters is about sqrt(rows), each query scans the closest few clusters
+IVF_NUM_PROBES = 8
+IVF_TRAINING_SAMPLE_SIZE = 100_000
+IVF_TRAINING_ITERATIONS = 10
+
+INDEX_FILE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "acoustic_index.npz")
+
+
+def _squared_distances(queries: np.ndarray, vectors: np.ndarray, vector_norms: np.ndarray) -> np.ndarray:
+    """Squared euclidean distances between each query and each vector, as one matrix product."""
+    query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+    return query_norms - 2.0 * queries @ vectors.T + vector_norms[None, :]
+
+
+def _merge_top_k(best_rows: np.ndarray, best_dists: np.ndarray, rows: np.ndarray, dists: np.ndarray, k: int):
+    """Merge a block of candidate rows into the running per-query top-k."""
+    all_rows = np.concatenate([best_rows, rows], axis=1)
+    all_dists = np.concatenate([best_dists, dists], axis=1)
+    if all_dists.shape[1] > k:
+        part = np.argpartition(all_dists, k - 1, axis=1)[:, :k]
+        all_rows = np.take_along_axis(all_rows, part, axis=1)
+        all_dists = np.take_along_axis(all_dists, part, axis=1)
+    return all_rows, all_dists
+
+
+def _assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    centroid_norms = np.einsum("ij,ij->i", centroids, centroids)
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), SEARCH_BLOCK_SIZE):
+        block = vectors[start:start + SEARCH_BLOCK_SIZE]
+        assignment[start:start + len(block)] = _squared_distances(block, centroids, centroid_norms).argmin(axis=1)
+    return assignment
+
+
+class AcousticIndex:
+    """k-NN index over the standardised acoustic feature vectors of the catalog.
+
+    Small catalogs are searched exactly in blocks of rows; large ones use an IVF index (k-means coarse
+    clusters with rows grouped by cluster) and only scan the clusters closest to each query.
+    """
+
+    def __init__(self, ids: np.ndarray, mean: np.ndarray, std: np.ndarray, vectors: np.ndarray,
+                 centroids: Optional[np.ndarray] = None, list_offsets: Optional[np.ndarray] = None,
+                 list_rows: Optional[np.ndarray] = None):
+        self.ids = ids
+        self.mean = mean
+        self.std = std
+        self.vectors = vectors
+        self.vector_norms = np.einsum("ij,ij->i", vectors, vectors)
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_rows = list_rows
+
+    @property
+    def is_approximate(self) -> bool:
+        return self.centroids is not None
+
+    @classmethod
+    def build(cls, catalog: SongCatalog) -> "AcousticIndex":
+        """Standardise the catalog feature vectors and build the index fitting the catalog size."""
+        raw = np.column_stack([catalog.column(name, fill_missing=0.0) for name in VECTOR_FEATURES]).astype(np.float32)
+        mean = raw.mean(axis=0) if len(raw) else np.zeros(len(VECTOR_FEATURES), dtype=np.float32)
+        std = raw.std(axis=0) if len(raw) else np.ones(len(VECTOR_FEATURES), dtype=np.float32)
+        std[std == 0] = 1.0
+        vectors = ((raw - mean) / std).astype(np.float32)
+
+        if len(vectors) <= EXACT_SEARCH_MAX_ROWS:
+            return cls(catalog.ids.copy(), mean, std, vectors)
+
+        centroids = cls._train_centroids(vectors)
+        assignment = _assign_to_centroids(vectors, centroids)
+        list_rows = np.argsort(assignment, kind="stable").astype(np.int64)
+        list_offsets = np.concatenate([[0], np.cumsum(np.bincount(assignment, minlength=len(centroids)))])
+        return cls(catalog.ids.copy(), mean, std, vectors, centroids, list_offsets, list_rows)
+
+    @staticmethod
+    def _train_centroids(vectors: np.ndarray) -> np.ndarray:
+        """Plain k-means on a random sample of the vectors."""
+        rng = np.random.default_rng(0)
+        num_lists = max(1, int(np.sqrt(len(vectors))))
+        sample = vectors[rng.choice(len(vectors), size=min(len(vectors), IVF_TRAINING_SAMPLE_SIZE), replace=False)]
+        centroids = sample[rng.choice(len(sample), size=num_lists, replace=False)].copy()
+        for _ in range(IVF_TRAINING_ITERATIONS):
+            assignment = _assign_to_centroids(sample, centroids)
+            counts = np.bincount(assignment, minlength=num_lists)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            non_empty = counts > 0
+            centroids[non_empty] = sums[non_empty] / counts[non_empty, None]
+        return centroids
+
+    def save(self, path: str = INDEX_FILE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {"ids": self.ids, "mean": self.mean, "std": self.std, "vectors": self.vectors}
+        if self.is_approximate:
+            arrays.update(centroids=self.centroids, list_offsets=self.list_offsets, list_rows=self.list_rows)
+        # Write next to the target and swap it in, so concurrent readers never see a partial file
+        temp_path = path + ".tmp.npz"
+        np.savez(temp_path, **arrays)
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, catalog: SongCatalog, path: str = INDEX_FILE_PATH) -> Optional["AcousticIndex"]:
+        """Load a persisted index, or return None if it is missing or was built for a different catalog."""
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            if not np.array_equal(data["ids"], catalog.ids):
+                return None
+            optional = {name: data[name] for name in ("centroids", "list_offsets", "list_rows") if name in data}
+            return cls(data["ids"], data["mean"], data["std"], data["vectors"], **optional)
+
+    def search(self, queries: np.ndarray, k: int, excluded: Optional[np.ndarray] = None) -> np.ndarray:
+        """Return, per query row of standardised vectors, the row indices of its k nearest catalog songs.
+
+        `excluded` is a boolean mask over the catalog rows that must not be returned. Rows are ordered from
+        nearest to farthest; queries with fewer than k eligible songs get -1 padding.
+        """
+        queries = np.atleast_2d(queries).astype(np.float32)
+        if self.is_approximate:
+            return self._search_ivf(queries, k, excluded)
+        return self._search_exact(queries, k, excluded)
+
+    def _search_exact(self, queries: np.ndarray, k: int, excluded: Optional[np.ndarray]) -> np.ndarray:
+        best_rows = np.full((len(queries), 0), -1, dtype=np.int64)
+        best_dists = np.full((len(queries), 0), np.inf, dtype=np.float32)
+        for start in range(0, len(self.vectors), SEARCH_BLOCK_SIZE):
+            stop = min(start + SEARCH_BLOCK_SIZE, len(self.vectors))
+            dists = _squared_distances(queries, self.vectors[start:stop], self.vector_norms[start:stop])
+            if excluded is not None:
+                dists[:, excluded[start:stop]] = np.inf
+            rows = np.broadcast_to(np.arange(start, stop), dists.shape)
+            best_rows, best_dists = _merge_top_k(best_rows, best_dists, rows, dists, k)
+        return self._finalize(best_rows, best_dists, k)
+
+    def _search_ivf(self, queries: np.ndarray, k: int, excluded: Optional[np.ndarray]) -> np.ndarray:
+        centroid_norms = np.einsum("ij,ij->i", self.centroids, self.centroids)
+        num_probes = min(IVF_NUM_PROBES, len(self.centroids))
+        probes = np.argpartition(_squared_distances(queries, self.centroids, centroid_norms), num_probes - 1, axis=1)
+
+        results = []
+        for query, query_probes in zip(queries, probes[:, :num_probes]):
+            rows = np.concatenate([
+                self.list_rows[self.list_offsets[probe]:self.list_offsets[probe + 1]] for probe in query_probes
+            ])
+            if excluded is not None:
+                rows = rows[~excluded[rows]]
+            dists = _squared_distances(query[None, :], self.vectors[rows], self.vector_norms[rows])
+            empty = np.full((1, 0), -1, dtype=np.int64)
+            best_rows, best_dists = _merge_top_k(empty, empty.astype(np.float32), rows[None, :], dists, k)
+            results.append(self._finalize(best_rows, best_dists, k)[0])
+        return np.stack(results) if results else np.empty((0, k), dtype=np.int64)
+
+    @staticmethod
+    def _finalize(rows: np.ndarray, dists: np.ndarray, k: int) -> np.ndarray:
+        order = np.argsort(dists, axis=1)
+        rows = np.take_along_axis(rows, order, axis=1)
+        rows = np.where(np.isinf(np.take_along_axis(dists, order, axis=1)), -1, rows)
+        if rows.shape[1] < k:
+            rows = np.pad(rows, ((0, 0), (0, k - rows.shape[1])), constant_values=-1)
+        return rows
+
+
+class AcousticIndexService:
+    """Keeps the acoustic index in step with the current catalog snapshot, persisting it on disk."""
+
+    def __init__(self, path: str = INDEX_FILE_PATH):
+        self.path = path
+        self._index: Optional[AcousticIndex] = None
+        self._catalog_version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def get(self, catalog: SongCatalog) -> AcousticIndex:
+        """Return the index of the given catalog, loading it from disk or building it if needed."""
+        with self._lock:
+            if self._index is None or self._catalog_version != catalog.version:
+                self._index = AcousticIndex.load(catalog, self.path) or self._build(catalog)
+                self._catalog_version = catalog.version
+            return self._index
+
+    def rebuild(self, catalog: SongCatalog) -> AcousticIndex:
+        """Build and persist a fresh index, e.g. right after seeding."""
+        with self._lock:
+            self._index = self._build(catalog)
+            self._catalog_version = catalog.version
+            return self._index
+
+    def invalidate(self):
+        """Drop the loaded index; the next `get` loads or builds it again."""
+        with self._lock:
+            self._index = None
+            self._catalog_version = None
+
+    def _build(self, catalog: SongCatalog) -> AcousticIndex:
+        index = AcousticIndex.build(catalog)
+        index.save(self.path)
+        print(f"Built {'IVF' if index.is_approximate else 'exact'} acoustic index over {len(index.ids)} songs.")
+        return index
+
+
+acoustic_index_service = AcousticIndexService()
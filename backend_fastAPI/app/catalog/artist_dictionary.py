@@ -0,0 +1,70 @@
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+from rapidfuzz import fuzz, process
+
+from app.utils import advanced_normalize_text
+from .song_catalog import SongCatalog
+
+ARTIST_MATCH_SCORE_CUTOFF = 70
+
+
+class ArtistDictionary:
+    """Preprocessed artist names of a catalog snapshot for fuzzy artist lookups.
+
+    Artist names are normalised once into match keys; artists sharing a key are merged, and the song ids of
+    every key are kept in one contiguous array so a match resolves to its songs without querying the songs table.
+    """
+
+    def __init__(self, catalog: SongCatalog):
+        self.catalog_version = catalog.version
+        self.keys: List[str] = []
+        self.names: List[str] = []  # First original spelling of each key
+        key_indices: Dict[str, int] = {}
+
+        code_to_key = np.empty(len(catalog.artists.values), dtype=np.int32)
+        for code, name in enumerate(catalog.artists.values):
+            key = advanced_normalize_text(name or "")
+            if key not in key_indices:
+                key_indices[key] = len(self.keys)
+                self.keys.append(key)
+                self.names.append(name)
+            code_to_key[code] = key_indices[key]
+
+        # Group the song ids by artist key: songs of key i are song_ids[offsets[i]:offsets[i + 1]]
+        row_keys = code_to_key[catalog.artist_codes]
+        order = np.argsort(row_keys, kind="stable")
+        self._song_ids = catalog.ids[order]
+        self._offsets = np.concatenate([[0], np.cumsum(np.bincount(row_keys, minlength=len(self.keys)))])
+
+    def match(self, artist_name: str, score_cutoff: int = ARTIST_MATCH_SCORE_CUTOFF) -> Optional[int]:
+        """Return the index of the artist key best matching the name, or None if nothing scores high enough."""
+        query = advanced_normalize_text(artist_name)
+        if not query or not self.keys:
+            return None
+
+        # A single query scores on one core; extractOne raises the cutoff as better keys are found
+        match = process.extractOne(query, self.keys, scorer=fuzz.WRatio, processor=None, score_cutoff=score_cutoff)
+        return None if match is None else match[2]
+
+    def song_ids(self, key_index: int) -> List[int]:
+        """Return the ids of all songs by the artists of a key."""
+        return self._song_ids[self._offsets[key_index]:self._offsets[key_index + 1]].tolist()
+
+
+class ArtistDictionaryService:
+    """Keeps the artist dictionary in step with the current catalog snapshot; seeding replaces the snapshot."""
+
+    def __init__(self):
+        self._dictionary: Optional[ArtistDictionary] = None
+        self._lock = threading.Lock()
+
+    def get(self, catalog: SongCatalog) -> ArtistDictionary:
+        with self._lock:
+            if self._dictionary is None or self._dictionary.catalog_version != catalog.version:
+                self._dictionary = ArtistDictionary(catalog)
+            return self._dictionary
+
+
+artist_dictionary_service = ArtistDictionaryService()
@@ -0,0 +1,116 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import false, or_
+
+from ..models import SongModel
+from .song_catalog import SongCatalog
+
+# Exclusive (lower, upper) bounds on a song feature; None leaves that side open
+FeatureRange = Tuple[Optional[float], Optional[float]]
+FeatureRule = Dict[str, FeatureRange]
+
+# Missing feature values are treated as 0 when matching, like the original per-song checks did
+MISSING_FEATURE_VALUE = 0.0
+
+MOOD_RULES: Dict[str, FeatureRule] = {
+    "sad": {"valence": (None, 0.3)},  # Stricter threshold for sadness
+    "energetic": {"energy": (0.75, None)},  # Higher energy required for energetic
+    "chill": {"valence": (0.55, None), "energy": (None, 0.3)},  # Higher valence and lower energy for chill
+    "upbeat": {"energy": (0.75, None), "valence": (0.55, None)},  # Stricter upbeat condition
+    "romantic": {"valence": (0.7, None), "energy": (None, 0.6)},  # Romantic needs higher valence
+    "relaxing": {"energy": (None, 0.3)},  # Lower energy required for relaxing
+    "calm": {"energy": (None, 0.35), "valence": (0.55, None)},  # Even lower energy and higher valence
+    "happy": {"valence": (0.65, None)},  # Stricter threshold for happy songs
+    "motivational": {"energy": (0.75, None), "valence": (0.6, None)},  # Both higher energy and valence
+    "fun": {"danceability": (0.75, None)},  # Increased danceability for fun
+    "lively": {"energy": (0.65, None)},  # Stricter threshold for lively
+    "peaceful": {"valence": (0.7, None), "energy": (None, 0.3)},  # High valence, low energy
+    "bright": {"energy": (0.7, None), "valence": (0.65, None)},  # Stricter threshold for bright
+    "mellow": {"energy": (None, 0.4)},  # Mellow requires lower energy
+    "uplifting": {"valence": (0.7, None), "energy": (0.55, None)},  # Both high valence and energy
+    "fast-paced": {"tempo": (120, None)},  # Stricter fast-paced tempo requirement
+    "slow": {"tempo": (None, 85)},  # Stricter slow tempo
+    "pump-up": {"energy": (0.85, None)},  # Very high energy for pump-up
+}
+
+ACTIVITY_RULES: Dict[str, FeatureRule] = {
+    "gym": {"energy": (0.8, None)},  # Requires higher energy for gym
+    "workout": {"energy": (0.8, None)},  # Higher energy required for workout
+    "study": {"instrumentalness": (0.6, None)},  # Stricter instrumentalness threshold for study
+    "party": {"danceability": (0.75, None)},  # Increased danceability for party
+    "road trip": {"energy": (0.65, None), "danceability": (0.65, None)},  # Higher energy and danceability
+    "sleep": {"energy": (None, 0.25)},  # Much lower energy required for sleep
+    "running": {"energy": (0.7, None), "tempo": (120, None)},  # Higher energy and tempo for running
+    "meditation": {"energy": (None, 0.3), "instrumentalness": (0.7, None)},  # Low energy, high instrumentalness
+    "relaxation": {"energy": (None, 0.4), "valence": (0.65, None)},  # More strict relaxing conditions
+    "evening": {"energy": (None, 0.45)},  # Lower energy for evening
+    "night out": {"danceability": (0.75, None)},  # Stricter danceability for night out
+    "dinner date": {"valence": (0.65, None), "energy": (None, 0.5)},  # Higher valence and lower energy
+    "morning run": {"energy": (0.75, None), "tempo": (120, None)},  # Stricter energy and tempo for morning run
+    "reading": {"instrumentalness": (0.7, None)},  # Higher instrumentalness for reading
+    "spa day": {"energy": (None, 0.25), "valence": (0.65, None)},  # Very low energy, high valence
+    "night in": {"energy": (None, 0.45)},  # Low energy for night in
+    "dance party": {"danceability": (0.8, None)},  # Even higher danceability for dance party
+}
+
+
+def _intersect(a: FeatureRange, b: FeatureRange) -> FeatureRange:
+    lower = max((x for x in (a[0], b[0]) if x is not None), default=None)
+    upper = min((x for x in (a[1], b[1]) if x is not None), default=None)
+    return lower, upper
+
+
+def combine_description_rules(moods: Iterable[str] = (), activities: Iterable[str] = ()) -> Optional[FeatureRule]:
+    """Merge the rules of all given moods and activities into one rule with a single range per feature.
+
+    Returns None if any mood or activity is unknown, since such a description matches no song.
+    """
+    combined: FeatureRule = {}
+    rules = [MOOD_RULES.get(mood) for mood in moods] + [ACTIVITY_RULES.get(activity) for activity in activities]
+    for rule in rules:
+        if rule is None:
+            return None
+        for feature, feature_range in rule.items():
+            combined[feature] = _intersect(combined.get(feature, (None, None)), feature_range)
+    return combined
+
+
+def _accepts_missing(feature_range: FeatureRange) -> bool:
+    lower, upper = feature_range
+    return (lower is None or MISSING_FEATURE_VALUE > lower) and (upper is None or MISSING_FEATURE_VALUE < upper)
+
+
+def description_rule_mask(catalog: SongCatalog, rule: Optional[FeatureRule]) -> np.ndarray:
+    """Evaluate a rule over the catalog feature columns as one boolean mask, one pass per feature."""
+    if rule is None:
+        return np.zeros(len(catalog), dtype=bool)
+
+    mask = np.ones(len(catalog), dtype=bool)
+    for feature, (lower, upper) in rule.items():
+        values = catalog.column(feature, fill_missing=MISSING_FEATURE_VALUE)
+        if lower is not None:
+            mask &= values > lower
+        if upper is not None:
+            mask &= values < upper
+    return mask
+
+
+def description_rule_clauses(rule: Optional[FeatureRule]) -> List:
+    """Compile a rule into SQL WHERE clauses over the songs table, one per feature bound."""
+    if rule is None:
+        return [false()]
+
+    clauses = []
+    for feature, feature_range in rule.items():
+        column = getattr(SongModel, feature)
+        lower, upper = feature_range
+        bounds = []
+        if lower is not None:
+            bounds.append(column > lower)
+        if upper is not None:
+            bounds.append(column < upper)
+        for bound in bounds:
+            # Keep the plain comparison index-friendly and add NULL explicitly where 0 would match
+            clauses.append(or_(bound, column.is_(None)) if _accepts_missing(feature_range) else bound)
+    return clauses
@@ -0,0 +1,206 @@
+import threading
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.utils import advanced_normalize_text
+from .song_catalog import SongCatalog
+
+# Names that consist only of these words are too common in chat messages to be linked
+LINKER_STOPWORDS = {
+    "a", "add", "album", "all", "an", "and", "artist", "by", "can", "first", "for", "from", "i", "in", "is",
+    "it", "last", "me", "my", "of", "on", "one", "play", "playlist", "please", "remove", "second", "show",
+    "some", "song", "songs", "that", "the", "this", "to", "track", "tracks", "was", "what", "when", "who",
+    "with", "you",
+}
+LINKER_MIN_PATTERN_CHARS = 3
+
+_TOKEN_SHIFT = 24  # Transition keys pack (node, token id) into one int; supports up to 16M distinct tokens
+
+
+def _group_song_ids(catalog: SongCatalog, row_keys: np.ndarray, num_keys: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Group catalog song ids by key: the songs of key i are ids[offsets[i]:offsets[i + 1]]."""
+    order = np.argsort(row_keys, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(row_keys, minlength=num_keys))])
+    return catalog.ids[order], offsets
+
+
+class GazetteerEntityLinker:
+    """Aho-Corasick automaton over the normalised song titles, artists and albums of a catalog snapshot.
+
+    The automaton runs over word tokens, so matches always align with word boundaries and a message is
+    scanned in time linear in its length. Every name resolves to the ids of the songs carrying it.
+    """
+
+    def __init__(self, catalog: SongCatalog):
+        self.catalog_version = catalog.version
+        self._vocab: Dict[str, int] = {}
+        self._goto: Dict[int, int] = {}
+        self._fail = array("i", [0])
+        self._output_link = array("i", [-1])  # Nearest node on the fail chain (itself included) ending a pattern
+        self._outputs: Dict[int, List[int]] = {}
+
+        # Pattern tables: entity type, display value, length in tokens and the song ids carrying the name
+        self._entities: List[str] = []
+        self._values: List[str] = []
+        self._lengths: List[int] = []
+        self._song_ids: List[np.ndarray] = []
+
+        self._add_table(catalog, "song", catalog.titles.values, catalog.title_codes,
+                        [title or "" for title in catalog.normalized_titles])
+        self._add_table(catalog, "artist", catalog.artists.values, catalog.artist_codes)
+        self._add_table(catalog, "album", catalog.albums.values, catalog.album_codes)
+        self._build_failure_links()
+
+    def _add_table(self, catalog: SongCatalog, entity: str, values: List[Optional[str]], codes: np.ndarray,
+                   normalized: Optional[List[str]] = None):
+        """Add the names of one interned string table, merging names that normalise to the same text."""
+        normalized = normalized or [advanced_normalize_text(value or "") for value in values]
+        key_of_text: Dict[str, int] = {}
+        code_keys = np.empty(len(values), dtype=np.int32)
+        display: List[str] = []
+        for code, text in enumerate(normalized):
+            if text not in key_of_text:
+                key_of_text[text] = len(display)
+                display.append(values[code] or "")
+            code_keys[code] = key_of_text[text]
+
+        song_ids, offsets = _group_song_ids(catalog, code_keys[codes], len(display))
+        for text, key in key_of_text.items():
+            tokens = text.split()
+            if len(text) < LINKER_MIN_PATTERN_CHARS or all(token in LINKER_STOPWORDS for token in tokens):
+                continue
+            self._add_pattern(tokens, entity, display[key], song_ids[offsets[key]:offsets[key + 1]])
+
+    def _add_pattern(self, tokens: List[str], entity: str, value: str, song_ids: np.ndarray):
+        node = 0
+        for token in tokens:
+            token_id = self._vocab.setdefault(token, len(self._vocab))
+            key = node << _TOKEN_SHIFT | token_id
+            child = self._goto.get(key)
+            if child is None:
+                child = self._goto[key] = len(self._fail)
+                self._fail.append(0)
+                self._output_link.append(-1)
+            node = child
+
+        self._outputs.setdefault(node, []).append(len(self._entities))
+        self._entities.append(entity)
+        self._values.append(value)
+        self._lengths.append(len(tokens))
+        self._song_ids.append(song_ids)
+
+    def _build_failure_links(self):
+        """Breadth-first pass computing failure links and output links of the trie."""
+        children: Dict[int, List[Tuple[int, int]]] = {}
+        for key, child in self._goto.items():
+            children.setdefault(key >> _TOKEN_SHIFT, []).append((key & ((1 << _TOKEN_SHIFT) - 1), child))
+
+        queue = [child for _, child in children.get(0, [])]
+        for child in queue:
+            self._output_link[child] = child if child in self._outputs else -1
+        head = 0
+        while head < len(queue):
+            node = queue[head]
+            head += 1
+            for token_id, child in children.get(node, []):
+                fail = self._fail[node]
+                while fail and (fail << _TOKEN_SHIFT | token_id) not in self._goto:
+                    fail = self._fail[fail]
+                fail = self._goto.get(fail << _TOKEN_SHIFT | token_id, 0)
+                self._fail[child] = fail
+                self._output_link[child] = child if child in self._outputs else self._output_link[fail]
+                queue.append(child)
+
+    def link(self, text: str) -> List[Dict[str, Any]]:
+        """Find catalog names in a message, keeping the longest non-overlapping spans.
+
+        Entities are returned in the shape of Rasa entities, extended with the candidate `song_ids`.
+        """
+        tokens = advanced_normalize_text(text).split()
+        matches = []
+        node = 0
+        for position, token in enumerate(tokens):
+            token_id = self._vocab.get(token)
+            if token_id is None:
+                node = 0
+                continue
+            while node and (node << _TOKEN_SHIFT | token_id) not in self._goto:
+                node = self._fail[node]
+            node = self._goto.get(node << _TOKEN_SHIFT | token_id, 0)
+
+            output = self._output_link[node]
+            while output > 0:
+                for pattern in self._outputs[output]:
+                    matches.append((position + 1 - self._lengths[pattern], position + 1, pattern))
+                output = self._output_link[self._fail[output]]
+
+        # Longest spans win; a span may still carry several entity types (e.g. an album named like its song)
+        taken = [False] * len(tokens)
+        selected = []
+        for start, end, pattern in sorted(matches, key=lambda m: (m[0] - m[1], m[0])):
+            span_taken = any(taken[start:end])
+            same_span = any(s == start and e == end for s, e, _ in selected)
+            if span_taken and not same_span:
+                continue
+            for i in range(start, end):
+                taken[i] = True
+            selected.append((start, end, pattern))
+
+        return [
+            {
+                "entity": self._entities[pattern],
+                "value": self._values[pattern],
+                "extractor": "gazetteer",
+                "song_ids": self._song_ids[pattern].tolist(),
+            }
+            for _, _, pattern in sorted(selected)
+        ]
+
+
+class EntityLinkerService:
+    """Holds the entity linker of the current catalog snapshot and rebuilds it on a background thread.
+
+    Lookups never wait for a build: until the linker of the current catalog version is ready, `get`
+    returns None (song ids of an older snapshot may no longer be valid after a reseed).
+    """
+
+    def __init__(self):
+        self._linker: Optional[GazetteerEntityLinker] = None
+        self._building_version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def get(self, catalog: SongCatalog) -> Optional[GazetteerEntityLinker]:
+        linker = self._linker
+        if linker is not None and linker.catalog_version == catalog.version:
+            return linker
+        self.rebuild_in_background(catalog)
+        return None
+
+    def rebuild_in_background(self, catalog: SongCatalog):
+        with self._lock:
+            if self._building_version == catalog.version:
+                return
+            self._building_version = catalog.version
+        threading.Thread(target=self._build, args=(catalog,), name="entity-linker-build", daemon=True).start()
+
+    def invalidate(self):
+        """Drop the current linker; lookups return None until the linker of the next catalog is built."""
+        with self._lock:
+            self._linker = None
+
+    def _build(self, catalog: SongCatalog):
+        linker = None
+        try:
+            linker = GazetteerEntityLinker(catalog)
+            print(f"Built entity linker for catalog version {catalog.version}.")
+        finally:
+            with self._lock:
+                if self._building_version == catalog.version:
+                    self._building_version = None
+                if linker is not None and (self._linker is None or self._linker.catalog_version < linker.catalog_version):
+                    self._linker = linker
+
+
+entity_linker_service = EntityLinkerService()
@@ -0,0 +1,145 @@
+import threading
+from array import array
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+from rapidfuzz import fuzz, process
+from sqlalchemy.orm import Session
+
+from app.utils import advanced_normalize_text
+from .song_catalog import SongCatalog, get_song_catalog
+
+NGRAM_SIZE = 3
+NGRAM_MAX_CANDIDATES = 200  # Candidates passed from the n-gram overlap stage to fuzzy scoring
+
+
+def text_ngrams(text: str, n: int = NGRAM_SIZE) -> Set[str]:
+    """Character n-grams of a normalised text, padded so that word starts and ends form their own grams."""
+    padded = f"{' ' * (n - 1)}{text} "
+    return {padded[i:i + n] for i in range(len(padded) - n + 1)}
+
+
+class NGramIndex:
+    """Inverted index from character n-grams to catalog songs, used to find fuzzy candidates for a text.
+
+    Candidates are ranked by their n-gram overlap (Dice coefficient) with the query over the whole catalog,
+    and only the best ones are scored with rapidfuzz. Songs can be added one by one after the initial build.
+    """
+
+    def __init__(self, catalog_field: str = "title"):
+        self.catalog_field = catalog_field
+        self.song_ids = array("q")
+        self.texts: List[str] = []
+        self._num_grams = array("i")
+        self._postings: Dict[str, array] = {}
+        # Appending to an array is not allowed while numpy views of it exist, so reads and adds are serialised
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_catalog(cls, catalog: SongCatalog, catalog_field: str = "title") -> "NGramIndex":
+        """Index the normalised titles, or with `catalog_field` the artists or albums, of a catalog snapshot."""
+        index = cls(catalog_field)
+        if catalog_field == "title":
+            texts = [catalog.normalized_titles[code] for code in catalog.title_codes]
+        else:
+            table = catalog.artists if catalog_field == "artist" else catalog.albums
+            normalized = [advanced_normalize_text(value or "") for value in table.values]
+            codes = catalog.artist_codes if catalog_field == "artist" else catalog.album_codes
+            texts = [normalized[code] for code in codes]
+
+        for song_id, text in zip(catalog.ids.tolist(), texts):
+            index.add(song_id, text)
+        return index
+
+    def __len__(self) -> int:
+        return len(self.song_ids)
+
+    def add(self, song_id: int, text: str):
+        """Add one song to the index under its normalised text."""
+        grams = text_ngrams(text or "")
+        with self._lock:
+            doc = len(self.song_ids)
+            self.song_ids.append(song_id)
+            self.texts.append(text or "")
+            self._num_grams.append(len(grams))
+            for gram in grams:
+                postings = self._postings.get(gram)
+                if postings is None:
+                    postings = self._postings[gram] = array("i")
+                postings.append(doc)
+
+    def candidates(
+        self, query: str, limit: int = NGRAM_MAX_CANDIDATES, song_ids: Optional[Sequence[int]] = None
+    ) -> np.ndarray:
+        """Return the documents sharing the most n-grams with the query, best first.
+
+        With `song_ids`, only the documents of those songs compete for the `limit` candidates.
+        """
+        grams = text_ngrams(query)
+        with self._lock:
+            postings = [np.frombuffer(self._postings[gram], dtype=np.int32) for gram in grams if gram in self._postings]
+            if not postings:
+                return np.empty(0, dtype=np.int64)
+            docs, overlap = np.unique(np.concatenate(postings), return_counts=True)
+            if song_ids is not None:
+                doc_song_ids = np.frombuffer(self.song_ids, dtype=np.int64)[docs]
+                allowed = np.isin(doc_song_ids, np.asarray(song_ids, dtype=np.int64))
+                docs, overlap = docs[allowed], overlap[allowed]
+            num_grams = np.frombuffer(self._num_grams, dtype=np.int32)[docs]
+            del postings
+        dice = 2.0 * overlap / (len(grams) + num_grams)
+
+        if len(docs) > limit:
+            best = np.argpartition(-dice, limit - 1)[:limit]
+            docs, dice = docs[best], dice[best]
+        return docs[np.argsort(-dice, kind="stable")]
+
+    def search(
+        self, query: str, score_cutoff: float, limit: int = NGRAM_MAX_CANDIDATES,
+        song_ids: Optional[Sequence[int]] = None,
+    ) -> List[Tuple[int, float]]:
+        """Fuzzy-match a normalised query against the index (or only the songs `song_ids`), returning
+        (song id, score) pairs, best first."""
+        docs = self.candidates(query, limit, song_ids)
+        if not len(docs):
+            return []
+
+        scores = process.cdist([query], [self.texts[doc] for doc in docs], scorer=fuzz.WRatio, processor=None)[0]
+        matches = [(self.song_ids[doc], float(score)) for doc, score in zip(docs, scores) if score >= score_cutoff]
+        return sorted(matches, key=lambda match: (-match[1], match[0]))
+
+
+class TitleIndexService:
+    """Holds the process-wide title n-gram index.
+
+    It is built from the catalog on first use, extended with songs as they are inserted, and dropped
+    when the songs table is reseeded.
+    """
+
+    def __init__(self):
+        self._index: Optional[NGramIndex] = None
+        self._lock = threading.Lock()
+
+    def get(self, db: Session) -> NGramIndex:
+        index = self._index
+        if index is not None:
+            return index
+        catalog = get_song_catalog(db)  # Loaded outside the index lock, which only guards the build
+        with self._lock:
+            if self._index is None:
+                self._index = NGramIndex.from_catalog(catalog)
+            return self._index
+
+    def add_song(self, song_id: int, normalized_title: str):
+        """Add a newly inserted song to the index if it is built. Otherwise the index picks the song up when it
+        is built, provided the song catalog was invalidated after the insert."""
+        with self._lock:
+            if self._index is not None:
+                self._index.add(song_id, normalized_title)
+
+    def invalidate(self):
+        with self._lock:
+            self._index = None
+
+
+title_index_service = TitleIndexService()
@@ -0,0 +1,220 @@
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy.orm import Session
+
+from ..models import SongModel
+from ..schemas import SongSchema
+
+# The ten acoustic feature columns of the songs table, in a fixed order
+ACOUSTIC_FEATURES: Tuple[str, ...] = (
+    "acousticness", "danceability", "energy", "instrumentalness", "key",
+    "liveness", "loudness", "mode", "speechiness", "valence",
+)
+
+CATALOG_LOAD_BATCH_SIZE = 10000
+
+
+class _StringTable:
+    """Interns repeated strings into a list of unique values addressed by integer codes."""
+
+    def __init__(self):
+        self.values: List[Optional[str]] = []
+        self._codes: Dict[Optional[str], int] = {}
+
+    def intern(self, value: Optional[str]) -> int:
+        code = self._codes.get(value)
+        if code is None:
+            code = len(self.values)
+            self._codes[value] = code
+            self.values.append(value)
+        return code
+
+    def code_of(self, value: Optional[str]) -> int:
+        """Return the code of a value, or -1 if the value is not in the table."""
+        return self._codes.get(value, -1)
+
+
+class SongCatalog:
+    """Read-only columnar snapshot of the songs table.
+
+    Rows are sorted by song id, so a row index doubles as a rank and ids can be resolved with a binary search.
+    Float columns keep missing values as NaN, integer columns as 0 with a mask marking the missing values.
+    """
+
+    def __init__(self, version: int = 0):
+        self.version = version
+        self.ids = np.empty(0, dtype=np.int64)
+        self.years = np.empty(0, dtype=np.int32)
+        self.durations = np.empty(0, dtype=np.int32)
+        self.years_missing = np.empty(0, dtype=bool)
+        self.durations_missing = np.empty(0, dtype=bool)
+        self.tempo = np.empty(0, dtype=np.float32)
+        self.features: Dict[str, np.ndarray] = {name: np.empty(0, dtype=np.float32) for name in ACOUSTIC_FEATURES}
+
+        # Interned string tables and the per-row codes pointing into them
+        self.titles = _StringTable()
+        self.normalized_titles: List[str] = []  # Aligned with the title table
+        self.artists = _StringTable()
+        self.albums = _StringTable()
+        self.title_codes = np.empty(0, dtype=np.int32)
+        self.artist_codes = np.empty(0, dtype=np.int32)
+        self.album_codes = np.empty(0, dtype=np.int32)
+
+    @classmethod
+    def from_db(cls, db: Session, version: int = 0) -> "SongCatalog":
+        """Load the songs table as plain row tuples (no ORM objects) into column arrays."""
+        catalog = cls(version)
+        feature_columns = [getattr(SongModel, name) for name in ACOUSTIC_FEATURES]
+        rows = (
+            db.query(
+                SongModel.id, SongModel.title, SongModel.normalized_title, SongModel.artist,
+                SongModel.album, SongModel.year, SongModel.duration, SongModel.tempo, *feature_columns,
+            )
+            .order_by(SongModel.id)
+            .yield_per(CATALOG_LOAD_BATCH_SIZE)
+        )
+
+        ids, years, durations, tempo = [], [], [], []
+        title_codes, artist_codes, album_codes = [], [], []
+        feature_values: List[List[Optional[float]]] = [[] for _ in ACOUSTIC_FEATURES]
+
+        for row in rows:
+            ids.append(row[0])
+            title_code = catalog.titles.intern(row[1])
+            if title_code == len(catalog.normalized_titles):
+                catalog.normalized_titles.append(row[2])
+            title_codes.append(title_code)
+            artist_codes.append(catalog.artists.intern(row[3]))
+            album_codes.append(catalog.albums.intern(row[4]))
+            years.append(row[5])
+            durations.append(row[6])
+            tempo.append(row[7])
+            for values, value in zip(feature_values, row[8:]):
+                values.append(value)
+
+        catalog.ids = np.asarray(ids, dtype=np.int64)
+        catalog.years_missing = np.fromiter((year is None for year in years), dtype=bool, count=len(years))
+        catalog.durations_missing = np.fromiter(
+            (duration is None for duration in durations), dtype=bool, count=len(durations)
+        )
+        catalog.years = np.asarray([year or 0 for year in years], dtype=np.int32)
+        catalog.durations = np.asarray([duration or 0 for duration in durations], dtype=np.int32)
+        catalog.tempo = np.asarray(tempo, dtype=np.float32)  # None becomes NaN
+        catalog.features = {
+            name: np.asarray(values, dtype=np.float32) for name, values in zip(ACOUSTIC_FEATURES, feature_values)
+        }
+        catalog.title_codes = np.asarray(title_codes, dtype=np.int32)
+        catalog.artist_codes = np.asarray(artist_codes, dtype=np.int32)
+        catalog.album_codes = np.asarray(album_codes, dtype=np.int32)
+        return catalog
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def column(self, name: str, fill_missing: Optional[float] = None) -> np.ndarray:
+        """Return a numeric column by its SongModel attribute name, optionally replacing NaN with a value."""
+        if name in self.features:
+            values = self.features[name]
+        elif name in ("tempo", "durations", "years", "ids"):
+            values = getattr(self, name)
+        elif name in ("duration", "year"):
+            values = getattr(self, name + "s")
+        else:
+            raise KeyError(f"Unknown catalog column: {name}")
+
+        if fill_missing is not None and values.dtype.kind == "f":
+            return np.nan_to_num(values, nan=fill_missing)
+        return values
+
+    def indices_for_ids(self, song_ids: Iterable[int]) -> np.ndarray:
+        """Map song ids to row indices, silently dropping ids that are not in the catalog."""
+        song_ids = np.fromiter(song_ids, dtype=np.int64)
+        if len(self.ids) == 0:
+            return np.empty(0, dtype=np.int64)
+        indices = np.searchsorted(self.ids, song_ids)
+        indices[indices == len(self.ids)] = 0
+        return indices[self.ids[indices] == song_ids]
+
+    def title(self, index: int) -> Optional[str]:
+        return self.titles.values[self.title_codes[index]]
+
+    def artist(self, index: int) -> Optional[str]:
+        return self.artists.values[self.artist_codes[index]]
+
+    def album(self, index: int) -> Optional[str]:
+        return self.albums.values[self.album_codes[index]]
+
+    def to_dto(self, index: int) -> SongSchema:
+        """Build the SongSchema of a single catalog row."""
+        title_code = self.title_codes[index]
+        features = {name: _optional_float(self.features[name][index]) for name in ACOUSTIC_FEATURES}
+        features["key"] = None if features["key"] is None else int(features["key"])
+        features["mode"] = None if features["mode"] is None else bool(features["mode"])
+        return SongSchema(
+            id=int(self.ids[index]),
+            title=self.titles.values[title_code],
+            normalized_title=self.normalized_titles[title_code],
+            artist=self.artist(index),
+            album=self.album(index),
+            year=None if self.years_missing[index] else int(self.years[index]),
+            duration=None if self.durations_missing[index] else int(self.durations[index]),
+            tempo=_optional_float(self.tempo[index]),
+            **features,
+        )
+
+    def to_dtos(self, indices: Iterable[int]) -> List[SongSchema]:
+        """Build SongSchemas for the given row indices, keeping their order."""
+        return [self.to_dto(index) for index in indices]
+
+
+def _optional_float(value: np.floating) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
+
+
+class SongCatalogService:
+    """Process-wide holder of the current SongCatalog snapshot.
+
+    The catalog is loaded lazily on first use and replaced atomically on refresh, so readers never see a
+    half-built snapshot. Derived structures can compare `catalog.version` to know when to rebuild.
+    Loading blocks on the database under a thread lock, so async code calls it from a worker thread
+    (`run_in_threadpool` with a sync session), never through `AsyncSession.run_sync` on the event loop.
+    """
+
+    def __init__(self):
+        self._catalog: Optional[SongCatalog] = None
+        self._version = 0
+        self._lock = threading.Lock()
+
+    def get(self, db: Session) -> SongCatalog:
+        """Return the current catalog, loading it from the database if needed."""
+        catalog = self._catalog
+        if catalog is not None:
+            return catalog
+        with self._lock:
+            if self._catalog is None:
+                self._load(db)
+            return self._catalog
+
+    def refresh(self, db: Session) -> SongCatalog:
+        """Reload the catalog from the database, e.g. after seeding."""
+        with self._lock:
+            self._load(db)
+            return self._catalog
+
+    def invalidate(self):
+        """Drop the current snapshot; the next `get` reloads it."""
+        with self._lock:
+            self._catalog = None
+
+    def _load(self, db: Session):
+        self._version += 1
+        self._catalog = SongCatalog.from_db(db, self._version)
+        print(f"Loaded song catalog version {self._version} with {len(self._catalog)} songs.")
+
+
+song_catalog = SongCatalogService()
+
+def get_song_catalog(db: Session) -> SongCatalog:
+    return song_catalog.get(db)
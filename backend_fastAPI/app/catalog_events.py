@@ -0,0 +1,40 @@
+import uuid
+
+from starlette.concurrency import run_in_threadpool
+
+from .catalog import acoustic_index_service, entity_linker_service, song_catalog, title_index_service
+from .event_broker import event_broker
+from .serialization import playlist_json_cache, song_json_cache
+
+# Broker channel announcing that the songs table was reseeded. Every worker keeps its own in-memory
+# catalog caches, so the worker that seeded tells the others to drop theirs.
+CATALOG_EVENTS_CHANNEL = "catalog_invalidated"
+
+# Identifies this worker in the events it publishes, so it can skip its own (its caches are already fresh)
+WORKER_ID = uuid.uuid4().hex
+
+
+def invalidate_catalog_caches():
+    """Drop every cache of this process derived from the songs table; each is reloaded on next use."""
+    song_catalog.invalidate()
+    title_index_service.invalidate()
+    acoustic_index_service.invalidate()
+    entity_linker_service.invalidate()
+    song_json_cache.invalidate()
+    playlist_json_cache.invalidate()
+
+
+async def publish_catalog_invalidated():
+    """Tell the other workers that the songs table changed; call after the seeding transaction committed."""
+    await event_broker.publish(CATALOG_EVENTS_CHANNEL, WORKER_ID)
+
+
+async def _on_catalog_invalidated(payload: str):
+    if payload == WORKER_ID:
+        return
+    print("Songs table changed on another worker, dropping the catalog caches.")
+    # The cache locks may be held by a catalog load in a worker thread, so do not take them on the event loop
+    await run_in_threadpool(invalidate_catalog_caches)
+
+
+event_broker.subscribe(CATALOG_EVENTS_CHANNEL, _on_catalog_invalidated)
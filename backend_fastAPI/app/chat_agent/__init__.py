@@ -1 +1,4 @@
-from .chat_agent import *
\ No newline at end of file
+from .chat_agent import *
+from .nlu_client import *
+from .nlu_cache import *
+from .nlu_fast_path import *
\ No newline at end of file
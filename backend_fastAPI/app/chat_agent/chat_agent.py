@@ -1,23 +1,29 @@
 from collections import deque
-from typing import Deque, List, Optional, Union
-import requests
-from requests import Session
+from typing import Callable, Deque, List, Optional, Union
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .chat_utils import *
+from .nlu_fast_path import default_nlu_client
+from .nlu_client import BaseNLUClient, NLUClientError
 from app.chat_agent_service import ChatAgentService
+from app.repository import MAX_NUM_SONGS_SEARCH
 
 class ChatAgent:
-    def __init__(self, db_session: Session, user_id: int):
-        self.service = ChatAgentService(db_session)
+    def __init__(self, user_id: int, nlu_client: Optional[BaseNLUClient] = None,
+                 session_factory: Optional[Callable[[], AsyncSession]] = None):
+        # Sessions are opened per message by the service, from the shared pool unless a factory is injected
+        self.service = ChatAgentService(session_factory) if session_factory else ChatAgentService()
         self.user_id = user_id
+        # Shared pooled NLU client unless another one (e.g. pointed at a local stub) is injected
+        self.nlu_client = nlu_client or default_nlu_client
         # Map intents to ChatAgentService functions
         self.welcome_sent = False
         self.response_queue: Deque[str] = deque()  # Queue to store multiple responses
         # Stores state needed to handle multi-response conversations
         self.conversation_context = ConversationContext()
 
-    def create_playlist_if_not_exist(self, user_id: str):
-        self.service.create_playlist_if_not_exist(user_id)
+    async def create_playlist_if_not_exist(self, user_id: str):
+        await self.service.create_playlist_if_not_exist(user_id)
     
     def add_response(self, message: str, action: str = "message"):
         self.response_queue.append({"action": action, "message": message})
@@ -72,7 +78,7 @@ class ChatAgent:
             case Commands.remove.value:
                 await self.remove_song_async(message_split)
             case Commands.view.value:
-                self.view_playlist()
+                await self.view_playlist()
             case Commands.clear.value:
                 await self.clear_playlist_async()
             case Commands.recommend.value:
@@ -86,10 +92,16 @@ class ChatAgent:
     async def handle_rasa_response(self, message: str):
         print("---------------------------------------------------------")
         print(message)
-        rasa_resp = requests.post(RASA_URL, json={"text": message}).json()
+        try:
+            rasa_resp = await self.nlu_client.parse(message)
+        except NLUClientError as e:
+            print("NLU request failed:", e)
+            self.add_response("I'm having trouble understanding messages right now. Please try again in a moment.")
+            return
+
         intent_name = rasa_resp.get("intent", {}).get("name")
-        confidence = rasa_resp.get("intent", {}).get("confidence")
-        entities = rasa_resp.get("entities")
+        confidence = rasa_resp.get("intent", {}).get("confidence") or 0
+        entities = rasa_resp.get("entities") or []
 
         print("Intent: ", intent_name)
         print("Intent confidence: ", confidence)
@@ -121,7 +133,7 @@ class ChatAgent:
         if confidence > 0.7:
             match intent:
                 case Intents.list_songs_in_playlist:
-                    self.view_playlist()
+                    await self.view_playlist()
                 case Intents.empty_playlist:
                     await self.clear_playlist_async()
                 case Intents.remove_from_playlist_position:
@@ -133,14 +145,15 @@ class ChatAgent:
                 case Intents.generate_playlist_based_on_description:
                     await self.generate_playlist_based_on_description(entities)
                 case _:
-                    await self.handle_more_intents(intent, entities)
+                    await self.handle_more_intents(intent, entities, message)
             return
 
         self.add_response("I'm sorry, I didn't understand that. (too low confidence score)")
 
 
-    async def handle_more_intents(self, intent: Intents, entities: list):
-        song_details: SongDetails = extract_rasa_song_details(entities)
+    async def handle_more_intents(self, intent: Intents, entities: list, message: str = ""):
+        linked_entities = await self.service.link_entities(message) if intent == Intents.add_song_to_playlist else []
+        song_details: SongDetails = extract_rasa_song_details(entities, linked_entities)
 
         # Use match-case to map intents to service functions
         match intent:
@@ -151,19 +164,21 @@ class ChatAgent:
                 self.learn_about_system()
                 return
             case Intents.ask_song_release_date:
-                result = self.service.get_song_release_date(entities)
+                result = await self.service.get_song_release_date(entities)
             case Intents.ask_songs_of_artist:
-                result = self.service.get_songs_by_artist(entities)
+                result = await self.service.get_songs_by_artist(entities)
             case Intents.ask_artist_of_song:
-                result = self.service.get_artist_of_song(entities)
+                result = await self.service.get_artist_of_song(entities)
             case Intents.ask_album_release_date:
-                result = self.service.get_album_release_date(entities)
+                result = await self.service.get_album_release_date(entities)
             case Intents.ask_album_of_song:
-                result = self.service.get_albums_of_song(entities)
+                result = await self.service.get_albums_of_song(entities)
             case Intents.ask_albums_of_artist:
-                result = self.service.get_albums_of_artist(entities)
+                result = await self.service.get_albums_of_artist(entities)
             case Intents.add_song_to_playlist:
-                await self.add_song_conversation_start(song_details.title, song_details.artist, song_details.album)
+                await self.add_song_conversation_start(
+                    song_details.title, song_details.artist, song_details.album, song_details.song_ids
+                )
                 return
             case Intents.remove_song_from_playlist:
                 result = await self.service.rasa_remove_song_from_playlist(entities)
@@ -178,13 +193,20 @@ class ChatAgent:
             self.add_response("I couldn't find the information you're looking for.")
 
 
-    async def add_song_conversation_start(self, title: str, artist: str = None, album: str = None) -> None:
+    async def add_song_conversation_start(
+        self, title: str, artist: str = None, album: str = None, song_ids: Optional[List[int]] = None
+    ) -> None:
         print("Add song conversation start")
         print(f"Title: {title}, Artist: {artist}, Album: {album}")
 
         if title:
-            # Find matching songs based on current details
-            song_matches: List[SongSchema] = self.service.find_song_matches(title, artist, None, None)
+            if song_ids:
+                # The entity linker already resolved the candidate songs
+                song_matches: List[SongSchema] = await self.service.get_songs_by_ids(song_ids)
+            else:
+                # Find matching songs based on current details
+                song_matches: List[SongSchema] = await self.service.find_song_matches(title, artist, None, None)
+            song_matches = song_matches[:MAX_NUM_SONGS_SEARCH]
 
             print("Num song matches: ", len(song_matches))
 
@@ -266,8 +288,8 @@ class ChatAgent:
             self.add_response("Please provide the song details to remove.")
 
 
-    def view_playlist(self):
-        playlist_data = self.service.view_playlist(playlist_id=self.user_id)
+    async def view_playlist(self):
+        playlist_data = await self.service.view_playlist(playlist_id=self.user_id)
         
         if playlist_data and playlist_data.songs:
             self.add_response("Your playlist includes:")
@@ -5,9 +5,11 @@ import re
 from typing import Dict, List, Optional
 
 from app.schemas import SongSchema
+from app.utils import advanced_normalize_text
 
 # Endpoints for API services
 RASA_URL = "http://localhost:5005/model/parse"
+RASA_STATUS_URL = "http://localhost:5005/status"
 
 RANDOM_QUESTION_CHANCE = 0
 MAX_NUM_SONGS = 5
@@ -78,6 +80,7 @@ class SongDetails:
     title: Optional[str] = None
     album: Optional[str] = None
     year: Optional[int] = None
+    song_ids: Optional[List[int]] = None  # Candidate songs of the title resolved by the entity linker
 
 @dataclass
 class AddSongContext:
@@ -136,7 +139,7 @@ def parse_add_song_input(input_text):
     # Return the extracted artist and title, or just title if artist is not provided
     return title.strip(), (artist.strip() if artist else None)
 
-def extract_rasa_song_details(entities: List[Dict[str, str]]) -> SongDetails:
+def extract_rasa_song_details(entities: List[Dict[str, str]], linked_entities: Optional[List[Dict]] = None) -> SongDetails:
     song_details = SongDetails()
     for entity in entities:
         entity_type = entity['entity']
@@ -147,4 +150,30 @@ def extract_rasa_song_details(entities: List[Dict[str, str]]) -> SongDetails:
             song_details.artist = value
         elif entity_type == IntentType.album.value:
             song_details.album = value
+
+    # Catalog names found by the entity linker fill in what Rasa missed and narrow down the candidate songs
+    fields = {IntentType.song.value: "title", IntentType.artist.value: "artist", IntentType.album.value: "album"}
+    linked_fields = set()
+    for entity in linked_entities or []:
+        field_name = fields.get(entity['entity'])
+        if field_name is None:
+            continue
+        current = getattr(song_details, field_name)
+        if current is None:
+            setattr(song_details, field_name, entity['value'])
+        elif advanced_normalize_text(current) != advanced_normalize_text(entity['value']):
+            continue
+
+        if song_details.song_ids is None:
+            song_details.song_ids = list(entity['song_ids'])
+        else:
+            candidates = set(entity['song_ids'])
+            song_details.song_ids = [song_id for song_id in song_details.song_ids if song_id in candidates]
+        linked_fields.add(field_name)
+
+    # Without a linked title the candidates are e.g. every song of an artist, and an artist or album the linker
+    # did not recognize (a typo, a partial name) would not narrow them down: both are left to title matching
+    unlinked_fields = {name for name in ("artist", "album") if getattr(song_details, name) is not None} - linked_fields
+    if "title" not in linked_fields or unlinked_fields:
+        song_details.song_ids = None
     return song_details
\ No newline at end of file
@@ -0,0 +1,129 @@
+import asyncio
+import copy
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .nlu_client import BaseNLUClient, NLUClientError
+
+NLU_CACHE_MAX_ENTRIES = 4096
+NLU_CACHE_TTL_SECONDS = 15 * 60
+NLU_FINGERPRINT_CHECK_INTERVAL_SECONDS = 30
+
+
+def normalize_utterance(text: str) -> str:
+    """Cache key of an utterance: case-folded with whitespace collapsed."""
+    return " ".join(text.casefold().split())
+
+
+class CachingNLUClient(BaseNLUClient):
+    """LRU + TTL cache in front of another NLU client.
+
+    Identical utterances that are in flight at the same time share one upstream request (single flight).
+    The cache is cleared when the fingerprint of the loaded NLU model changes, which is checked at most
+    every `fingerprint_check_interval` seconds.
+    """
+
+    def __init__(
+        self,
+        inner: BaseNLUClient,
+        max_entries: int = NLU_CACHE_MAX_ENTRIES,
+        ttl: float = NLU_CACHE_TTL_SECONDS,
+        fingerprint_check_interval: float = NLU_FINGERPRINT_CHECK_INTERVAL_SECONDS,
+    ):
+        self.inner = inner
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.fingerprint_check_interval = fingerprint_check_interval
+
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._fingerprint: Optional[str] = None
+        self._fingerprint_checked_at = float("-inf")
+        self._fingerprint_lock: Optional[asyncio.Lock] = None
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+
+    async def parse(self, text: str) -> Dict[str, Any]:
+        await self._check_fingerprint()
+        key = normalize_utterance(text)
+
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, result = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return copy.deepcopy(result)
+            del self._entries[key]
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self.coalesced += 1
+            return copy.deepcopy(await asyncio.shield(in_flight))
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._in_flight[key] = future
+        try:
+            result = await self.inner.parse(text)
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Mark as retrieved when nobody else was waiting
+            raise
+        else:
+            future.set_result(result)
+            self._store(key, result)
+            return copy.deepcopy(result)
+        finally:
+            self._in_flight.pop(key, None)
+            if not future.done():
+                # The leading request was cancelled: fail the coalesced callers rather than leave them waiting
+                future.set_exception(NLUClientError("Coalesced NLU request was cancelled"))
+                future.exception()
+
+    def _store(self, key: str, result: Dict[str, Any]):
+        self._entries[key] = (time.monotonic() + self.ttl, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def _check_fingerprint(self):
+        if time.monotonic() - self._fingerprint_checked_at < self.fingerprint_check_interval:
+            return
+        if self._fingerprint_lock is None:
+            self._fingerprint_lock = asyncio.Lock()
+
+        async with self._fingerprint_lock:
+            if time.monotonic() - self._fingerprint_checked_at < self.fingerprint_check_interval:
+                return
+            fingerprint = await self.inner.model_fingerprint()
+            self._fingerprint_checked_at = time.monotonic()
+            if fingerprint is None or fingerprint == self._fingerprint:
+                return
+            if self._fingerprint is not None:
+                print("NLU model changed, clearing the parse cache.")
+                self.invalidate()
+            self._fingerprint = fingerprint
+
+    def invalidate(self):
+        self._entries.clear()
+        self.invalidations += 1
+
+    async def model_fingerprint(self) -> Optional[str]:
+        return await self.inner.model_fingerprint()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+        }
+
+    async def aclose(self):
+        await self.inner.aclose()
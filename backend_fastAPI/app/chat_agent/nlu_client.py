@@ -0,0 +1,116 @@
+import asyncio
+import random
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Optional
+
+import httpx
+
+from .chat_utils import RASA_STATUS_URL, RASA_URL
+
+NLU_TIMEOUT_SECONDS = 5.0
+NLU_CONNECT_TIMEOUT_SECONDS = 2.0
+NLU_MAX_CONNECTIONS = 20
+NLU_MAX_KEEPALIVE_CONNECTIONS = 10
+NLU_MAX_CONCURRENCY = 16  # Parse requests in flight per process; the rest wait their turn
+NLU_MAX_RETRIES = 2
+NLU_RETRY_BASE_DELAY_SECONDS = 0.1
+
+
+class NLUClientError(Exception):
+    """Raised when the NLU service could not parse a message, even after retrying."""
+
+
+def _json_object(response: httpx.Response) -> Dict[str, Any]:
+    """Decode a JSON object response body, raising NLUClientError for anything else."""
+    try:
+        body = response.json()
+    except ValueError as e:
+        raise NLUClientError(f"NLU service returned invalid JSON: {e}") from e
+    if not isinstance(body, dict):
+        raise NLUClientError("NLU service returned JSON that is not an object")
+    return body
+
+
+class BaseNLUClient(ABC):
+    """Interface of the NLU stages a ChatAgent sends messages through."""
+
+    @abstractmethod
+    async def parse(self, text: str) -> Dict[str, Any]:
+        """Parse a message into the Rasa intent/entities response."""
+
+    async def model_fingerprint(self) -> Optional[str]:
+        """Identify the currently loaded NLU model, or None if unknown."""
+        return None
+
+    async def aclose(self):
+        pass
+
+
+class NLUClient(BaseNLUClient):
+    """Async client for the Rasa `/model/parse` endpoint.
+
+    Requests share one keep-alive connection pool, are bounded by a per-call timeout and a process-wide
+    concurrency limit, and are retried with exponential backoff and full jitter on connection errors and
+    5xx responses. Pass another `url`, or an httpx `transport`, to point it at a local stub.
+    """
+
+    def __init__(
+        self,
+        url: str = RASA_URL,
+        status_url: str = RASA_STATUS_URL,
+        timeout: float = NLU_TIMEOUT_SECONDS,
+        max_concurrency: int = NLU_MAX_CONCURRENCY,
+        max_retries: int = NLU_MAX_RETRIES,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.url = url
+        self.status_url = status_url
+        self.max_retries = max_retries
+        self._timeout = httpx.Timeout(timeout, connect=NLU_CONNECT_TIMEOUT_SECONDS)
+        self._limits = httpx.Limits(
+            max_connections=NLU_MAX_CONNECTIONS, max_keepalive_connections=NLU_MAX_KEEPALIVE_CONNECTIONS
+        )
+        self._transport = transport
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client: Optional[httpx.AsyncClient] = None
+
+    def _get_client(self) -> httpx.AsyncClient:
+        # Created on first use so that the pool belongs to the running event loop
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(timeout=self._timeout, limits=self._limits, transport=self._transport)
+        return self._client
+
+    async def parse(self, text: str) -> Dict[str, Any]:
+        """Parse a message into the Rasa intent/entities response."""
+        async with self._semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await self._get_client().post(self.url, json={"text": text})
+                    if response.status_code < 500:
+                        response.raise_for_status()
+                        return _json_object(response)
+                    error = NLUClientError(f"NLU service responded with {response.status_code}")
+                except httpx.TransportError as e:
+                    error = NLUClientError(f"NLU service unreachable: {e!r}")
+                except httpx.HTTPStatusError as e:
+                    raise NLUClientError(f"NLU service rejected the request: {e}") from e
+
+                if attempt < self.max_retries:
+                    await asyncio.sleep(random.uniform(0, NLU_RETRY_BASE_DELAY_SECONDS * 2 ** attempt))
+            raise error
+
+    async def model_fingerprint(self) -> Optional[str]:
+        """Return the fingerprint of the model Rasa has loaded, from its `/status` endpoint."""
+        try:
+            response = await self._get_client().get(self.status_url)
+            response.raise_for_status()
+            status = _json_object(response)
+        except (httpx.HTTPError, NLUClientError) as e:
+            print("Could not read the NLU model status:", e)
+            return None
+        return str(status.get("fingerprint") or status.get("model_file") or "") or None
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
@@ -0,0 +1,140 @@
+import os
+import re
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import yaml
+
+from app.rasa_data import RASA_DATA_FOLDER_PATH
+from .chat_utils import Intents
+from .nlu_cache import CachingNLUClient
+from .nlu_client import BaseNLUClient, NLUClient
+
+NLU_EXAMPLES_FILE_PATH = os.path.join(RASA_DATA_FOLDER_PATH, "nlu.yml")
+
+EXAMPLE_MATCH_CONFIDENCE = 0.99
+KEYWORD_MATCH_CONFIDENCE = 0.95
+
+# Entities that only mark the command verb of an example; the handlers never read them
+COMMAND_ENTITIES = {"show_command", "empty_command"}
+
+# Hand-written phrasings on top of the training examples, matched against the normalised message
+KEYWORD_PATTERNS: Sequence[Tuple[str, Intents]] = (
+    (r"(show|list|display|view)( me)?( my| the)?( current| whole| entire)? playlist", Intents.list_songs_in_playlist),
+    (r"what(s| is) (in|on) (my|the) playlist( right now| now)?", Intents.list_songs_in_playlist),
+    (r"(clear|empty|wipe)( out)? (my|the)( whole| entire)? playlist", Intents.empty_playlist),
+    (r"add (them all|all of them|all|everything|all of those|all of these)", Intents.add_all_recommended_songs),
+    (r"(recommend|suggest)( me)?( some)? (songs|tracks|music)", Intents.recommend_songs_based_on_playlist),
+)
+
+_ANNOTATION = re.compile(r"\[([^\]]+)\]\(([^)]+)\)")
+_POLITE_PREFIX = re.compile(r"^(please |can you |could you |would you )+")
+_POLITE_SUFFIX = re.compile(r"( please| thanks| thank you)+$")
+
+
+def normalize_message(text: str) -> str:
+    """Lower-case a message, drop apostrophes and punctuation, collapse whitespace and strip polite padding."""
+    text = text.lower().replace("'", "").replace("’", "")
+    text = " ".join(re.sub(r"[^\w\s-]", " ", text).split())
+    return _POLITE_SUFFIX.sub("", _POLITE_PREFIX.sub("", text))
+
+
+def _intent_response(text: str, intent: Intents, confidence: float) -> Dict[str, Any]:
+    """Shape a local classification like a Rasa parse response."""
+    return {"text": text, "intent": {"name": intent.name, "confidence": confidence}, "entities": []}
+
+
+class PreClassifier(ABC):
+    """A local stage that recognises some messages without asking the NLU service."""
+
+    @abstractmethod
+    def classify(self, text: str) -> Optional[Tuple[Intents, float]]:
+        """Return the intent and confidence of an unambiguous message, or None to fall through."""
+
+
+class PatternPreClassifier(PreClassifier):
+    """Matches whole messages against compiled patterns: the entity-free training examples and keyword rules."""
+
+    def __init__(self, patterns: Sequence[Tuple[str, Intents, float]]):
+        self.intents: List[Tuple[Intents, float]] = []
+        alternatives = []
+        for i, (pattern, intent, confidence) in enumerate(patterns):
+            alternatives.append(f"(?P<p{i}>{pattern})")
+            self.intents.append((intent, confidence))
+        self._regex = re.compile(r"^(?:" + "|".join(alternatives) + r")$") if alternatives else None
+
+    @classmethod
+    def from_nlu_file(cls, path: str = NLU_EXAMPLES_FILE_PATH) -> "PatternPreClassifier":
+        """Build the patterns from the Rasa NLU examples, skipping examples that carry entities and
+        phrasings that appear under more than one intent."""
+        examples: Dict[str, Optional[Intents]] = {}
+        try:
+            with open(path, encoding="utf-8") as f:
+                nlu_data = yaml.safe_load(f)
+        except OSError as e:
+            print(f"Could not read NLU examples for the fast path: {e}")
+            nlu_data = {}
+
+        for block in nlu_data.get("nlu", []):
+            intent = Intents.__members__.get(block.get("intent"))
+            if intent is None:
+                continue
+            for line in (block.get("examples") or "").splitlines():
+                example = line.strip().lstrip("-").strip()
+                entities = {entity for _, entity in _ANNOTATION.findall(example)}
+                if not example or entities - COMMAND_ENTITIES:
+                    continue
+                phrase = normalize_message(_ANNOTATION.sub(r"\1", example))
+                if phrase:
+                    # A phrase seen under two intents is ambiguous and left to the NLU service
+                    examples[phrase] = intent if examples.get(phrase, intent) == intent else None
+
+        patterns = [(re.escape(phrase), intent, EXAMPLE_MATCH_CONFIDENCE)
+                    for phrase, intent in examples.items() if intent is not None]
+        patterns += [(pattern, intent, KEYWORD_MATCH_CONFIDENCE) for pattern, intent in KEYWORD_PATTERNS]
+        return cls(patterns)
+
+    def classify(self, text: str) -> Optional[Tuple[Intents, float]]:
+        if self._regex is None:
+            return None
+        match = self._regex.match(normalize_message(text))
+        if match is None:
+            return None
+        return self.intents[int(match.lastgroup[1:])]
+
+
+class PreClassifyingNLUClient(BaseNLUClient):
+    """Runs local pre-classifiers ahead of another NLU client and only falls through when none matches."""
+
+    def __init__(self, inner: BaseNLUClient, pre_classifiers: Sequence[PreClassifier]):
+        self.inner = inner
+        self.pre_classifiers = list(pre_classifiers)
+        self.fast_path_hits = 0
+        self.fall_throughs = 0
+
+    async def parse(self, text: str) -> Dict[str, Any]:
+        for pre_classifier in self.pre_classifiers:
+            result = pre_classifier.classify(text)
+            if result is not None:
+                self.fast_path_hits += 1
+                return _intent_response(text, *result)
+
+        self.fall_throughs += 1
+        return await self.inner.parse(text)
+
+    async def model_fingerprint(self) -> Optional[str]:
+        return await self.inner.model_fingerprint()
+
+    def stats(self) -> Dict[str, int]:
+        stats = {"fast_path_hits": self.fast_path_hits, "fall_throughs": self.fall_throughs}
+        if hasattr(self.inner, "stats"):
+            stats.update(self.inner.stats())
+        return stats
+
+    async def aclose(self):
+        await self.inner.aclose()
+
+
+default_nlu_client = PreClassifyingNLUClient(
+    CachingNLUClient(NLUClient()), [PatternPreClassifier.from_nlu_file()]
+)
@@ -1,7 +1,13 @@
-import random
-from typing import List, Dict, Any, Optional
+from contextlib import asynccontextmanager
+from typing import Callable, List, Dict, Any, Optional
+import numpy as np
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from ..catalog_events import publish_catalog_invalidated
+from ..database import AsyncSessionLocal, SessionLocal
+from ..catalog import combine_description_rules, description_rule_mask, entity_linker_service, get_song_catalog
 from ..models import SongModel
 from ..schemas import SongSchema
 from app.websocket import ws_push_playlist_update
@@ -9,9 +15,35 @@ from app.chat_agent.chat_utils import IntentType
 import app.repository as r
 
 
+# Run playlist description filtering and sampling in PostgreSQL instead of over the in-memory catalog
+FILTER_PLAYLIST_DESCRIPTION_IN_DB = False
+
+
+def _call_with_session(session_factory: Callable[[], Session], fn: Callable, *args):
+    with session_factory() as db:
+        return fn(db, *args)
+
+
 class ChatAgentService:
-    def __init__(self, db_session: Session):
-        self.db = db_session
+    """Chat operations on an async session.
+
+    Simple lookups and playlist edits use the async repository; the catalog-backed and fuzzy matching
+    functions of the sync repository run through `AsyncSession.run_sync`, so their queries also await.
+    Functions that load or search the in-memory catalog and its indexes run in a worker thread with their
+    own sync session instead (see `run_on_catalog`): those loads are CPU heavy and guarded by thread locks.
+    The session only exists for one unit of work (a chat turn), see `unit_of_work`.
+    """
+
+    def __init__(
+        self,
+        session_factory: Callable[[], AsyncSession] = AsyncSessionLocal,
+        filter_in_db: bool = FILTER_PLAYLIST_DESCRIPTION_IN_DB,
+        sync_session_factory: Callable[[], Session] = SessionLocal,
+    ):
+        self.session_factory = session_factory
+        self.sync_session_factory = sync_session_factory
+        self.db: Optional[AsyncSession] = None
+        self.filter_in_db = filter_in_db
         self.position_map = {
             "first": 1, "second": 2, "third": 3, "fourth": 4, 
             "fifth": 5, "sixth": 6, "seventh": 7, "eight": 8,
@@ -23,12 +55,27 @@ class ChatAgentService:
             "ten": 10,
         }
 
-    def create_playlist_if_not_exist(self, user_id: int):
+    @asynccontextmanager
+    async def unit_of_work(self):
+        """Check out a session for one chat turn; it is closed, and its connection returned to the pool, afterwards."""
+        async with self.session_factory() as db:
+            self.db = db
+            try:
+                yield db
+            finally:
+                self.db = None
+
+    async def run_on_catalog(self, fn: Callable, *args):
+        """Run a sync repository function that uses the in-memory catalog in a worker thread, off the event loop."""
+        return await run_in_threadpool(_call_with_session, self.sync_session_factory, fn, *args)
+
+    async def create_playlist_if_not_exist(self, user_id: int):
         print(f"Trying to create playlist for user {user_id}, if not exist.")
-        r.create_playlist(self.db, user_id)
+        await r.create_playlist_async(self.db, user_id)
 
     async def seed_async(self) -> bool:
-        r.seed_db_demo(self.db)
+        await self.run_on_catalog(r.seed_db_demo)
+        await publish_catalog_invalidated()
         await ws_push_playlist_update()
         return True
     
@@ -36,71 +83,62 @@ class ChatAgentService:
     @staticmethod
     def _get_entity_value(entities: List[Dict[str, str]], entity_name: str) -> Optional[str]:
         return next((e['value'] for e in entities if e['entity'] == entity_name), None)
-    
-
-    def add_song_to_playlist(self, song_description: Dict[str, Any]) -> Optional[SongSchema]:
-        id = r.get_song_by_song_description(self.db, song_description)
-        if id:
-            song_model = r.add_song_to_playlist(self.db, 1, id)
-            return song_model.to_dto()
-        return None
 
+    @staticmethod
+    def _get_entity_values(entities: List[Dict[str, str]], entity_name: str) -> List[str]:
+        return [e['value'] for e in entities if e['entity'] == entity_name]
+    
 
     async def add_song_to_playlist_async(self, song_description: Dict[str, Any], user_id: int) -> Optional[SongSchema]:
         print(song_description)
-        id = r.get_song_by_song_description(self.db, song_description)
+        id = await self.db.run_sync(r.get_song_by_song_description, song_description)
         if id:
-            song_model = r.add_song_to_playlist(self.db, playlist_id=user_id, song_id=id)
-            await ws_push_playlist_update()
-            return song_model.to_dto()
+            change = await r.add_song_to_playlist_async(self.db, playlist_id=user_id, song_id=id)
+            if change.song:
+                await ws_push_playlist_update(user_id, change.version, added=change.songs)
+                return change.song.to_dto()
         return None
 
 
-    def remove_song_from_playlist(self, song_description: Dict[str, Any]) -> Optional[SongSchema]:
-        id = r.get_song_by_song_description(self.db, song_description) 
-        if id:
-            song_model = r.remove_song_from_playlist(self.db, 1, id)
-            return song_model.to_dto()
-        return None
-    
-
     async def remove_song_from_playlist_async(self, song_description: Dict[str, Any]) -> Optional[SongSchema]:
-        id = r.get_song_by_song_description(self.db, song_description) 
+        id = await self.db.run_sync(r.get_song_by_song_description, song_description)
         if id:
-            song_model = r.remove_song_from_playlist(self.db, 1, id)
-            await ws_push_playlist_update()
-            return song_model.to_dto()
+            change = await r.remove_song_from_playlist_async(self.db, 1, id)
+            if change.song:
+                await ws_push_playlist_update(1, change.version, removed=change.songs)
+                return change.song.to_dto()
         return None
     
 
-    def view_playlist(self, playlist_id: int = 1):
-        playlistModel = r.get_playlist(self.db, playlist_id)
+    async def view_playlist(self, playlist_id: int = 1):
+        playlistModel = await r.get_playlist_async(self.db, playlist_id)
         return playlistModel.to_dto() if playlistModel else None
 
 
-    def clear_playlist(self, playlist_id: int = 1):
-        r.clear_playlist(self.db, playlist_id)
-
-
     async def clear_playlist_async(self, playlist_id: int = 1):
-        r.clear_playlist(self.db, playlist_id)
-        await ws_push_playlist_update()
+        version = await r.clear_playlist_async(self.db, playlist_id)
+        await ws_push_playlist_update(playlist_id, version)
 
 
-    def get_song_release_date(self, entity_values: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+    async def get_song_release_date(self, entity_values: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
         song_name = self._get_entity_value(entity_values, IntentType.song.value)
         if song_name:
-            song_models = r.get_songs_by_name(self.db, song_name)
+            song_models = await r.get_songs_by_name_async(self.db, song_name)
             if song_models:
                 song = song_models[0].to_dto()  # Assuming we use the first result if multiple are found
                 return {"message": f"The song '{song.title}' by {song.artist} was released in {song.year}.", "song": song}
         return None 
     
 
-    def get_songs_by_artist(self, entity_values: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+    async def link_entities(self, text: str) -> List[Dict[str, Any]]:
+        """Song, artist and album names of the catalog mentioned in a message; empty while the linker is being built."""
+        linker = entity_linker_service.get(await self.run_on_catalog(get_song_catalog))
+        return linker.link(text) if linker is not None else []
+
+    async def get_songs_by_artist(self, entity_values: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
         artist_name = self._get_entity_value(entity_values, IntentType.artist.value)
         if artist_name:
-            song_models = r.get_songs_by_artist(self.db, artist_name)
+            song_models = await self.run_on_catalog(r.get_songs_by_artist, artist_name)
             songs = [song_model.to_dto() for song_model in song_models]
             if songs:
                 song_titles = ', '.join(song.title for song in songs)
@@ -108,30 +146,30 @@ class ChatAgentService:
         return None
 
 
-    def get_artist_of_song(self, entity_values: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+    async def get_artist_of_song(self, entity_values: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
         song_name = self._get_entity_value(entity_values, IntentType.song.value)
         if song_name:
-            song_models = self.find_song_matches(title=song_name)
+            song_models = await self.find_song_matches(title=song_name)
             if song_models:
-                song = song_models[0].to_dto()  # Use the first matching song
+                song = song_models[0]  # Use the first matching song
                 return {"message": f"The artist of the song '{song.title}' is {song.artist}.", "song": song}
         return None  # No match found
 
 
-    def get_album_release_date(self, entity_values: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+    async def get_album_release_date(self, entity_values: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
         album_name = self._get_entity_value(entity_values, IntentType.album.value)
         if album_name:
-            song_models = r.get_songs_by_album(self.db, album_name)
+            song_models = await r.get_songs_by_album_async(self.db, album_name)
             if song_models:
                 album_song = song_models[0].to_dto()  # Assume using the first song in the album to get the year
                 return {"message": f"The album '{album_song.album}' was released in {album_song.year}.", "album": album_song.album}
         return None  # No album found
 
 
-    def get_albums_of_song(self, entity_values: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+    async def get_albums_of_song(self, entity_values: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
         song_name = self._get_entity_value(entity_values, IntentType.song.value)
         if song_name:
-            song_models = self.find_song_matches(title=song_name)
+            song_models = await self.find_song_matches(title=song_name)
             if song_models:
                 unique_albums = set(song.album for song in song_models)
                 if unique_albums:
@@ -142,10 +180,10 @@ class ChatAgentService:
         return None  # No albums found for the given song
 
 
-    def get_albums_of_artist(self, entity_values: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+    async def get_albums_of_artist(self, entity_values: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
         artist_name = self._get_entity_value(entity_values, IntentType.artist.value)
         if artist_name:
-            song_models = r.get_songs_by_artist(self.db, artist_name)
+            song_models = await self.run_on_catalog(r.get_songs_by_artist, artist_name)
             unique_albums = set(song.album for song in (song_model.to_dto() for song_model in song_models))
             if unique_albums:
                 return {"message": f"The albums by {artist_name} are: {', '.join(unique_albums)}",
@@ -169,33 +207,27 @@ class ChatAgentService:
         position = self._get_entity_value(entity_values, "position")
         number = self._get_entity_value(entity_values, "number")
 
-        playlist = r.get_playlist(self.db, 1)
-        songs = SongModel.list_to_dto(playlist.songs)
-
-        remove_ids = []
-
+        # Positional removals are range deletes over the playlist order; "last" counts from the end
         if position and number:
             pos_index = self.position_map.get(position) - 1
             num = self.number_map.get(number)
 
             if pos_index == -1:
-                songs.reverse()
-                songs = songs[:num]
+                change = await r.remove_songs_at_index_async(self.db, 1, 0, num, from_end=True)
             else:
-                songs = songs[pos_index:num]
+                change = await r.remove_songs_at_index_async(self.db, 1, pos_index, max(num - pos_index, 0))
+            songs = SongModel.list_to_dto(change.songs)
 
-            remove_ids = [song.id for song in songs]
-            for id in remove_ids:
-                r.remove_song_from_playlist(self.db, 1, id)
-
-            await ws_push_playlist_update()
+            await ws_push_playlist_update(1, change.version, removed=change.songs)
             return {"message": "Removed songs from your playlist:", "songs": songs}
         
         if position and not number:
             pos_index = self.position_map.get(position) - 1
-            song_to_remove = songs[pos_index]
-            r.remove_song_from_playlist(self.db, 1, song_to_remove.id)
-            await ws_push_playlist_update()
+            change = await r.remove_songs_at_index_async(self.db, 1, max(pos_index, 0), from_end=pos_index == -1)
+            if not change.song:
+                return {"message": "There is no song at that position in your playlist."}
+            song_to_remove = change.song.to_dto()
+            await ws_push_playlist_update(1, change.version, removed=change.songs)
 
             return {"message": f"Song {song_to_remove.title} by {song_to_remove.artist} removed from your playlist", "song": song_to_remove}
 
@@ -205,20 +237,18 @@ class ChatAgentService:
     async def song_release_date_position(self, entity_values: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
         position = self._get_entity_value(entity_values, "position")
 
-        playlist = r.get_playlist(self.db, 1)
-        songs = playlist.songs
-
         if position:
             pos_index = self.position_map.get(position) - 1
-            song = songs[pos_index]
+            song = await r.get_song_at_index_async(self.db, 1, max(pos_index, 0), from_end=pos_index == -1)
+            if song is None:
+                return {"message": "There is no song at that position in your playlist."}
             return {"message": f"{song.title} by {song.artist} was released in {song.year}."}
 
         return {"message": "Did not understand"}
     
 
     async def recommend_songs_based_on_playlist(self) -> Optional[Dict[str, Any]]:
-        songs = r.get_recommendations_from_songs(self.db, 1)
-        recommended_songs = [song.to_dto() for song in songs]
+        recommended_songs = await self.run_on_catalog(r.recommend_similar_songs, 1)
         return {"message": "Recommendations based on your playlist: ", "songs": recommended_songs}
 
 
@@ -289,21 +319,21 @@ class ChatAgentService:
         return result            
 
     async def add_multiple_songs_to_playlist_async(self, ids) -> Dict[str, Any]:
-        songs = []
-
-        # Add each song by ID
-        for id in ids:
-            song = r.add_song_to_playlist(self.db, 1, id)
-            if song:
-                songs.append(song)
+        # Add all songs in one commit
+        change = await r.add_songs_to_playlist_async(self.db, 1, list(ids))
 
         # Push playlist update after all songs are added
-        await ws_push_playlist_update()
+        await ws_push_playlist_update(1, change.version, added=change.songs)
 
-        return {"message": "Added songs:", "songs": songs}
+        return {"message": "Added songs:", "songs": change.songs}
 
 
-    def find_song_matches(
+    async def get_songs_by_ids(self, song_ids: List[int]) -> List[SongSchema]:
+        """Look up songs that were already resolved, e.g. by the entity linker, in the in-memory catalog."""
+        catalog = await self.run_on_catalog(get_song_catalog)
+        return catalog.to_dtos(catalog.indices_for_ids(song_ids))
+
+    async def find_song_matches(
         self, 
         title: str, 
         artist: Optional[str] = None, 
@@ -313,7 +343,7 @@ class ChatAgentService:
         """Finds matching songs based on title and other optional fields like artist, album, and year."""
 
         # Step 1: Attempt an exact match first
-        exact_match = r.find_exact_song_match(self.db, title, artist, album, year)
+        exact_match = await self.db.run_sync(r.find_exact_song_match, title, artist, album, year)
 
         print("Exact match: ", exact_match)
         
@@ -322,7 +352,7 @@ class ChatAgentService:
             return [SongModel.to_dto(exact_match)]
 
         # Step 2: If no exact match, try flexible matching with find_song_matches
-        matched_songs_models = r.find_fuzzy_song_matches(self.db, title, artist, album, year)
+        matched_songs_models = await self.run_on_catalog(r.find_fuzzy_song_matches, title, artist, album, year)
         
         # If matches are found, convert the list of SongModel instances to DTOs
         if matched_songs_models:
@@ -337,19 +367,26 @@ class ChatAgentService:
         playlist_length = self.infer_playlist_length(entities)
         print("Inferred playlist length:", playlist_length)
 
-        # Get mood and activity from the entities
-        mood = self._get_entity_value(entities, "mood")
-        activity = self._get_entity_value(entities, "activity")
+        # Get all moods and activities from the entities, e.g. "a chill study playlist"
+        moods = self._get_entity_values(entities, "mood")
+        activities = self._get_entity_values(entities, "activity")
 
         # Use service to get recommended songs based on description
-        recommended_songs = await self.filter_songs_by_playlist_description(mood, activity, playlist_length)
+        if self.filter_in_db:
+            rule = combine_description_rules(moods, activities)
+            recommended_songs = SongModel.list_to_dto(
+                await self.db.run_sync(r.sample_songs_by_description, rule, playlist_length)
+            )
+        else:
+            recommended_songs = await self.filter_songs_by_playlist_description(moods, activities, playlist_length)
 
         print("Number of recommended songs found for playlist: ", len(recommended_songs))
 
         if recommended_songs:
-            self.clear_playlist()
+            # Replace the playlist contents in a single statement and notify once
             song_ids = [song.id for song in recommended_songs]
-            await self.add_multiple_songs_to_playlist_async(song_ids)
+            change = await r.replace_playlist_songs_async(self.db, 1, song_ids)
+            await ws_push_playlist_update(1, change.version)
 
             # Return the playlist with the recommended songs
             return {"message": f"Created a playlist with {len(recommended_songs)} songs based on your description.",
@@ -358,122 +395,33 @@ class ChatAgentService:
         return {"message": "Found no songs fitting the wanted playlist description."}
     
 
-    async def filter_songs_by_playlist_description(self, mood: Optional[str], activity: Optional[str], playlist_length_minutes: int) -> List[dict]:
-        # Query the database to get all songs
-        songs = SongModel.list_to_dto(r.get_all_songs(self.db))
+    async def filter_songs_by_playlist_description(self, moods: List[str], activities: List[str], playlist_length_minutes: int) -> List[SongSchema]:
+        # Read the songs from the in-memory catalog instead of the database
+        catalog = await self.run_on_catalog(get_song_catalog)
 
-        print(songs[0])
-
-        # Filter songs by mood and activity
-        if mood:
-            songs = [song for song in songs if self.match_mood(song, mood)]
-        if activity:
-            songs = [song for song in songs if self.match_activity(song, activity)]
+        # Filter songs by all moods and activities in a single vectorized pass over the feature columns
+        rule = combine_description_rules(moods, activities)
+        indices = np.flatnonzero(description_rule_mask(catalog, rule))
 
-        # Calculate the average song duration from the list of songs
-        # Assuming each song has a 'duration' field in seconds (e.g., 180 seconds = 3 minutes)
-        total_duration = sum(song.duration for song in songs)
-        num_songs = len(songs)
+        # Calculate the average song duration (in seconds) of the remaining songs
+        num_songs = len(indices)
 
         print("Num songs still here after mood and activity filtering: ", num_songs)
         
         if num_songs == 0:
             return []  # If no songs are found after filtering, return an empty list
         
-        average_song_duration = total_duration / num_songs  # average song duration in seconds
+        average_song_duration = catalog.durations[indices].mean()  # average song duration in seconds
         average_song_duration_minutes = average_song_duration / 60  # convert to minutes
         
         # Calculate how many songs fit in the requested playlist length
         num_songs_needed = int(playlist_length_minutes / average_song_duration_minutes)
         
         # If there are more songs than needed, select randomly
-        if len(songs) > num_songs_needed:
-            songs = r.get_recommendations_from_songs(self.db, 1, songs, num_songs_needed)
-
-        return songs
-    
-
-    def match_mood(self, song: SongSchema, mood: str) -> bool:
-        match mood:
-            case "sad":
-                return (song.valence or 0) < 0.3  # Stricter threshold for sadness
-            case "energetic":
-                return (song.energy or 0) > 0.75  # Higher energy required for energetic
-            case "chill":
-                return (song.valence or 0) > 0.55 and (song.energy or 0) < 0.3  # Higher valence and lower energy for chill
-            case "upbeat":
-                return (song.energy or 0) > 0.75 and (song.valence or 0) > 0.55  # Stricter upbeat condition
-            case "romantic":
-                return (song.valence or 0) > 0.7 and (song.energy or 0) < 0.6  # Romantic needs higher valence
-            case "relaxing":
-                return (song.energy or 0) < 0.3  # Lower energy required for relaxing
-            case "calm":
-                return (song.energy or 0) < 0.35 and (song.valence or 0) > 0.55  # Calm requires even lower energy and higher valence
-            case "happy":
-                return (song.valence or 0) > 0.65  # Stricter threshold for happy songs
-            case "motivational":
-                return (song.energy or 0) > 0.75 and (song.valence or 0) > 0.6  # Both higher energy and valence
-            case "fun":
-                return (song.danceability or 0) > 0.75  # Increased danceability for fun
-            case "lively":
-                return (song.energy or 0) > 0.65  # Stricter threshold for lively
-            case "peaceful":
-                return (song.valence or 0) > 0.7 and (song.energy or 0) < 0.3  # Peaceful needs high valence, low energy
-            case "bright":
-                return (song.energy or 0) > 0.7 and (song.valence or 0) > 0.65  # Stricter threshold for bright
-            case "mellow":
-                return (song.energy or 0) < 0.4  # Mellow requires lower energy
-            case "uplifting":
-                return (song.valence or 0) > 0.7 and (song.energy or 0) > 0.55  # Both high valence and energy for uplifting
-            case "fast-paced":
-                return (song.tempo or 0) > 120  # Stricter fast-paced tempo requirement
-            case "slow":
-                return (song.tempo or 0) < 85  # Stricter slow tempo
-            case "pump-up":
-                return (song.energy or 0) > 0.85  # Very high energy for pump-up
-            case _:
-                return False
-
-
-    def match_activity(self, song: SongSchema, activity: str) -> bool:
-        match activity:
-            case "gym":
-                return (song.energy or 0) > 0.8  # Requires higher energy for gym
-            case "workout":
-                return (song.energy or 0) > 0.8  # Higher energy required for workout
-            case "study":
-                return (song.instrumentalness or 0) > 0.6  # Stricter instrumentalness threshold for study
-            case "party":
-                return (song.danceability or 0) > 0.75  # Increased danceability for party
-            case "road trip":
-                return (song.energy or 0) > 0.65 and (song.danceability or 0) > 0.65  # Higher requirements for energy and danceability
-            case "sleep":
-                return (song.energy or 0) < 0.25  # Much lower energy required for sleep
-            case "running":
-                return (song.energy or 0) > 0.7 and (song.tempo or 0) > 120  # Higher energy and tempo for running
-            case "meditation":
-                return (song.energy or 0) < 0.3 and (song.instrumentalness or 0) > 0.7  # Requires both low energy and high instrumentalness
-            case "relaxation":
-                return (song.energy or 0) < 0.4 and (song.valence or 0) > 0.65  # More strict relaxing conditions
-            case "evening":
-                return (song.energy or 0) < 0.45  # Lower energy for evening
-            case "night out":
-                return (song.danceability or 0) > 0.75  # Stricter danceability for night out
-            case "dinner date":
-                return (song.valence or 0) > 0.65 and (song.energy or 0) < 0.5  # Requires higher valence and lower energy
-            case "morning run":
-                return (song.energy or 0) > 0.75 and (song.tempo or 0) > 120  # Stricter energy and tempo for morning run
-            case "reading":
-                return (song.instrumentalness or 0) > 0.7  # Higher instrumentalness for reading
-            case "spa day":
-                return (song.energy or 0) < 0.25 and (song.valence or 0) > 0.65  # Very low energy for spa day, high valence
-            case "night in":
-                return (song.energy or 0) < 0.45  # Low energy for night in
-            case "dance party":
-                return (song.danceability or 0) > 0.8  # Even higher danceability for dance party
-            case _:
-                return False
+        if num_songs > num_songs_needed:
+            return await self.run_on_catalog(r.get_recommendations_from_songs, 1, indices, num_songs_needed)
 
+        return catalog.to_dtos(indices)
 
 
     def infer_playlist_length(self, entities: list) -> int:
@@ -1,19 +1,20 @@
 import json
+import orjson
 from fastapi import WebSocket, WebSocketDisconnect
-from requests import Session
 from app.chat_agent import ChatAgent
 from .websocket import ws_manager_chat
 
 class ChatWSMediator:
-    def __init__(self, user_id: int, websocket: WebSocket, db: Session):
+    def __init__(self, user_id: int, websocket: WebSocket):
         self.user_id = user_id
         self.websocket = websocket
-        self.chat_agent = ChatAgent(db, user_id)
+        self.chat_agent = ChatAgent(user_id)
         self.awaiting_ack = False
 
     async def handle_connection(self):
         await ws_manager_chat.connect(self.user_id, self.websocket)
-        self.chat_agent.service.create_playlist_if_not_exist(self.user_id)
+        async with self.chat_agent.service.unit_of_work():
+            await self.chat_agent.create_playlist_if_not_exist(self.user_id)
 
         if not ws_manager_chat.has_sent_welcome(self.user_id):
             self.chat_agent.welcome()
@@ -39,8 +40,9 @@ class ChatWSMediator:
             await ws_manager_chat.disconnect(self.user_id)
             return
 
-        # Process the message with the chat agent
-        await self.chat_agent.process_message(user_message)
+        # Process the message with the chat agent, holding a database session only for this turn
+        async with self.chat_agent.service.unit_of_work():
+            await self.chat_agent.process_message(user_message)
 
         # Send all messages currently in the response queue
         await self.send_response_queue()
@@ -58,5 +60,5 @@ class ChatWSMediator:
                 self.awaiting_ack = True
       
             await ws_manager_chat.send_message(
-                self.user_id, json.dumps(next_response)
+                self.user_id, orjson.dumps(next_response).decode()
             )
\ No newline at end of file
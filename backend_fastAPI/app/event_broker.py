@@ -0,0 +1,141 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import asyncpg
+from sqlalchemy import text
+
+from .database import POSTGRES_DATABASE_URL, async_engine
+
+# Events published by one worker reach the WebSockets of every worker through the broker: the in-process
+# backend serves a single worker, the Postgres backend fans out to all workers through LISTEN/NOTIFY.
+EVENT_BROKER_BACKEND = "postgres"  # "postgres" or "memory"
+PG_NOTIFY_MAX_PAYLOAD_BYTES = 7999  # NOTIFY payloads must be shorter than 8000 bytes
+LISTENER_RECONNECT_MIN_SECONDS = 1
+LISTENER_RECONNECT_MAX_SECONDS = 30
+
+EventHandler = Callable[[str], Optional[Awaitable[None]]]
+
+
+class EventBroker:
+    """Publishes string payloads on named channels and dispatches the payloads it receives to local handlers.
+
+    Handlers are registered per channel before `start` and run on the event loop, so they must not block;
+    a handler returning a coroutine has it scheduled as a task.
+    """
+
+    max_payload_bytes: Optional[int] = None
+
+    def __init__(self):
+        self._handlers: Dict[str, List[EventHandler]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def subscribe(self, channel: str, handler: EventHandler):
+        self._handlers.setdefault(channel, []).append(handler)
+
+    def fits(self, payload: str) -> bool:
+        """Whether a payload can be published as is; callers fall back to a smaller payload otherwise."""
+        return self.max_payload_bytes is None or len(payload.encode()) <= self.max_payload_bytes
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, channel: str, payload: str):
+        raise NotImplementedError
+
+    def _dispatch(self, channel: str, payload: str):
+        for handler in self._handlers.get(channel, ()):
+            try:
+                result = handler(payload)
+            except Exception as e:
+                print(f"Error handling {channel} event: {e!r}")
+                continue
+            if asyncio.iscoroutine(result):
+                task = asyncio.create_task(self._await_handler(channel, result))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    @staticmethod
+    async def _await_handler(channel: str, result: Awaitable[None]):
+        try:
+            await result
+        except Exception as e:
+            print(f"Error handling {channel} event: {e!r}")
+
+
+class InProcessEventBroker(EventBroker):
+    """Dispatches published payloads directly to the handlers of this process."""
+
+    async def publish(self, channel: str, payload: str):
+        self._dispatch(channel, payload)
+
+
+class PostgresEventBroker(EventBroker):
+    """LISTEN/NOTIFY backend.
+
+    Each worker holds one dedicated listener connection for all channels, reconnecting with backoff when it
+    is lost, and re-dispatches every notification to its local handlers (its own included). Notifications
+    are sent through the pool of the async engine. Events sent while a listener reconnects are missed.
+    """
+
+    max_payload_bytes = PG_NOTIFY_MAX_PAYLOAD_BYTES
+
+    def __init__(self, dsn: str):
+        super().__init__()
+        self.dsn = dsn
+        self._supervisor: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._supervisor = asyncio.create_task(self._listen_forever())
+
+    async def stop(self):
+        if self._supervisor is not None:
+            self._supervisor.cancel()
+            try:
+                await self._supervisor
+            except asyncio.CancelledError:
+                pass
+            self._supervisor = None
+
+    async def publish(self, channel: str, payload: str):
+        async with async_engine.connect() as connection:
+            await connection.execute(text("SELECT pg_notify(:channel, :payload)"),
+                                     {"channel": channel, "payload": payload})
+            await connection.commit()
+
+    async def _listen_forever(self):
+        delay = LISTENER_RECONNECT_MIN_SECONDS
+        while True:
+            connection = None
+            lost = asyncio.Event()
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                connection.add_termination_listener(lambda _: lost.set())
+                for channel in self._handlers:
+                    await connection.add_listener(channel, self._on_notification)
+                print(f"Event broker listening on {', '.join(self._handlers)}.")
+                delay = LISTENER_RECONNECT_MIN_SECONDS
+                await lost.wait()
+                print("Event broker listener connection lost.")
+            except Exception as e:
+                print(f"Event broker listener failed: {e!r}")
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, LISTENER_RECONNECT_MAX_SECONDS)
+
+    def _on_notification(self, connection, pid: int, channel: str, payload: str):
+        self._dispatch(channel, payload)
+
+
+def create_event_broker(backend: str = EVENT_BROKER_BACKEND) -> EventBroker:
+    if backend == "postgres":
+        return PostgresEventBroker(POSTGRES_DATABASE_URL)
+    return InProcessEventBroker()
+
+
+event_broker = create_event_broker()
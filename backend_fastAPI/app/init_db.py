@@ -1,7 +1,9 @@
 import sqlite3
 from sqlalchemy.orm import Session
 
+from app.catalog import song_catalog, title_index_service
 from app.utils import advanced_normalize_text
+from .catalog_events import invalidate_catalog_caches
 from .models import PlaylistModel, SongModel, PlaylistSongsTable
 from sqlalchemy.orm import Session
 
@@ -57,6 +59,9 @@ def get_or_create_song(db: Session, title: str, artist: str, album: str, year: i
         db.add(song)
         db.commit()
         db.refresh(song)
+        # The catalog snapshot no longer matches the songs table; the title index is extended in place
+        song_catalog.invalidate()
+        title_index_service.add_song(song.id, normalized_title)
     
     return song
 
@@ -104,6 +109,7 @@ def add_demo_songs_to_playlist(db: Session, playlist_id: int):
         db.add(playlist)
     else:
         playlist.songs.extend(songs_to_add)
+        playlist.version = PlaylistModel.version + 1
 
     db.commit()
     print(f"Added demo songs to playlist {playlist_id}.")
@@ -113,6 +119,7 @@ def seed_db_demo(db: Session):
     """Seeds the database with manually defined demo songs and adds them to a playlist."""
     try:
         add_demo_songs_to_playlist(db, playlist_id=1)
+        invalidate_catalog_caches()
         print("Database seeded successfully with demo songs.")
 
     except Exception as e:
@@ -207,6 +214,9 @@ def seed_db_dataset_sqlite(db: Session, sqlite_db_path: str):
         # Add the demo songs to the playlist with id = 1
         add_demo_songs_to_playlist(db, playlist_id=1)
 
+        # The in-memory catalog caches of this worker no longer match the songs table; the caller tells the others
+        invalidate_catalog_caches()
+
     except Exception as e:
         db.rollback()
         print(f"Error during seeding: {e}")
@@ -1,7 +1,10 @@
 from fastapi import FastAPI
 from .routers import  client_only_routes, playlist_routes, song_routes, websocket_routes, seed_routes
 
-from .database import engine, DB_Base
+from .chat_agent import default_nlu_client
+from .database import async_engine, engine, DB_Base
+from .event_broker import event_broker
+from .websocket import playlist_update_coalescer
 
 # Create database tables
 DB_Base.metadata.create_all(bind=engine)
@@ -14,3 +17,24 @@ app.include_router(playlist_routes.router)
 app.include_router(song_routes.router)
 app.include_router(websocket_routes.router)
 app.include_router(seed_routes.router)
+
+
+@app.on_event("startup")
+async def start_event_broker():
+    await event_broker.start()
+
+
+@app.on_event("shutdown")
+async def stop_event_broker():
+    await playlist_update_coalescer.flush()
+    await event_broker.stop()
+
+
+@app.on_event("shutdown")
+async def close_nlu_client():
+    await default_nlu_client.aclose()
+
+
+@app.on_event("shutdown")
+async def dispose_async_engine():
+    await async_engine.dispose()
@@ -1,18 +1,31 @@
 from typing import List
-from sqlalchemy import Column, Integer, String, ForeignKey, Table, Float, Boolean
+from sqlalchemy import (
+    DDL, BigInteger, Column, Index, Integer, Sequence, String, ForeignKey, Table, Float, Boolean, event, func, text
+)
 from sqlalchemy.orm import relationship
 
 from .schemas import PlaylistSchema, SongSchema
 from .database import DB_Base
 
+# Songs are ordered within a playlist by a sparse position key: inserts take increasing keys from a
+# sequence, spaced by the gap, so that a song can be moved between two others without renumbering
+PLAYLIST_POSITION_GAP = 1024
+PlaylistPositionSequence = Sequence('playlist_songs_position_seq', metadata=DB_Base.metadata)
+
 # Many-to-Many Association Table for songs and playlists
 PlaylistSongsTable = Table(
     'playlist_songs',
     DB_Base.metadata,
     Column('playlist_id', Integer, ForeignKey('playlists.id'), primary_key=True),
-    Column('song_id', Integer, ForeignKey('songs.id'), primary_key=True)
+    Column('song_id', Integer, ForeignKey('songs.id'), primary_key=True),
+    Column('position', BigInteger, nullable=False,
+           server_default=text(f"nextval('playlist_songs_position_seq') * {PLAYLIST_POSITION_GAP}")),
+    Index('ix_playlist_songs_playlist_id_position', 'playlist_id', 'position'),
 )
 
+# Trigram GIN indexes used by the song search need the pg_trgm extension
+event.listen(DB_Base.metadata, "before_create", DDL("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+
 class SongModel(DB_Base):
     __tablename__ = 'songs'
     
@@ -22,25 +35,36 @@ class SongModel(DB_Base):
     album = Column(String)
     year = Column(Integer)
     duration = Column(Integer)
-    tempo = Column(Float)
+    tempo = Column(Float, index=True)
 
     # New normalized title column
     normalized_title = Column(String, nullable=False)
 
-    # Acoustic features
+    # Acoustic features (the indexed ones back the playlist description filters)
     acousticness = Column(Float)
-    danceability = Column(Float)
-    energy = Column(Float)
-    instrumentalness = Column(Float)
+    danceability = Column(Float, index=True)
+    energy = Column(Float, index=True)
+    instrumentalness = Column(Float, index=True)
     key = Column(Integer)
     liveness = Column(Float)
     loudness = Column(Float)
     mode = Column(Boolean)
     speechiness = Column(Float)
-    valence = Column(Float)
+    valence = Column(Float, index=True)
+
+    # Random key assigned on insert, used to sample songs with an index range scan instead of ORDER BY random()
+    sample_key = Column(Float, nullable=False, server_default=func.random(), index=True)
 
     playlists = relationship('PlaylistModel', secondary=PlaylistSongsTable, back_populates='songs')
 
+    __table_args__ = (
+        # Trigram indexes backing the substring / similarity search on titles and artists
+        Index('ix_songs_normalized_title_trgm', 'normalized_title',
+              postgresql_using='gin', postgresql_ops={'normalized_title': 'gin_trgm_ops'}),
+        Index('ix_songs_artist_trgm', 'artist',
+              postgresql_using='gin', postgresql_ops={'artist': 'gin_trgm_ops'}),
+    )
+
     def to_dto(self):
         """Map the SongModel instance to SongSchema for JSON serialization."""
         return SongSchema.from_orm(self)
@@ -59,8 +83,11 @@ class PlaylistModel(DB_Base):
     
     id = Column(Integer, primary_key=True, index=True)
     title = Column(String, index=True)
+    # Incremented by every change to the songs of the playlist; identifies a snapshot of its contents (ETag)
+    version = Column(BigInteger, nullable=False, server_default=text("0"))
 
-    songs = relationship('SongModel', secondary=PlaylistSongsTable, back_populates='playlists')
+    songs = relationship('SongModel', secondary=PlaylistSongsTable, back_populates='playlists',
+                         order_by=[PlaylistSongsTable.c.position, PlaylistSongsTable.c.song_id])
 
     def to_dto(self):
         """Map the PlaylistModel instance to PlaylistSchema for JSON serialization."""
@@ -1 +1,2 @@
-from .repository import *
\ No newline at end of file
+from .repository import *
+from .async_repository import *
\ No newline at end of file
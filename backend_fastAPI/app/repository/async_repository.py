@@ -0,0 +1,155 @@
+from dataclasses import dataclass, field
+from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+
+from ..models import PLAYLIST_POSITION_GAP, PlaylistModel, SongModel
+from .membership_statements import (
+    add_songs_statement, bump_version_statement, clear_songs_statement, neighbour_positions_statement,
+    remove_songs_at_index_statement, remove_songs_statement, renumber_positions_statement, replace_songs_statement,
+    set_position_statement, song_at_index_statement,
+)
+
+# Async variants of the repository functions used on the event loop (routes and the chat agent).
+# Relationships cannot be lazy loaded from async code, so playlists are loaded together with their songs.
+
+
+@dataclass
+class PlaylistChange:
+    """Songs added to or removed from a playlist by a mutation, and the playlist version it produced."""
+    songs: List[SongModel] = field(default_factory=list)
+    version: Optional[int] = None  # None if the playlist did not change
+
+    @property
+    def song(self) -> Optional[SongModel]:
+        return self.songs[0] if self.songs else None
+
+
+async def _bump_version_async(db: AsyncSession, playlist_id: int) -> Optional[int]:
+    result = await db.execute(bump_version_statement(playlist_id))
+    return result.scalar()
+
+async def _commit_change_async(db: AsyncSession, playlist_id: int, songs: List[SongModel]) -> PlaylistChange:
+    """Bump the playlist version if any song was affected and commit the mutation."""
+    version = await _bump_version_async(db, playlist_id) if songs else None
+    await db.commit()
+    return PlaylistChange(songs, version)
+
+
+async def create_playlist_async(db: AsyncSession, user_id: int):
+    playlist = await db.get(PlaylistModel, user_id)
+
+    if playlist:
+        return
+
+    playlist = PlaylistModel(title=f"User {user_id}'s favorite songs")
+    db.add(playlist)
+    await db.commit()
+
+async def get_playlist_async(db: AsyncSession, playlist_id: int) -> Optional[PlaylistModel]:
+    """Retrieve a specific playlist by ID with its songs loaded."""
+    result = await db.execute(
+        select(PlaylistModel)
+        .options(selectinload(PlaylistModel.songs))
+        .filter(PlaylistModel.id == playlist_id)
+        .execution_options(populate_existing=True)
+    )
+    return result.scalars().first()
+
+async def add_song_to_playlist_async(db: AsyncSession, playlist_id: int, song_id: int) -> PlaylistChange:
+    """Add a song to a specific playlist; the change holds the added song, if it was added."""
+    result = await db.execute(add_songs_statement(playlist_id, [song_id]))
+    return await _commit_change_async(db, playlist_id, result.scalars().all())
+
+async def remove_song_from_playlist_async(db: AsyncSession, playlist_id: int, song_id: int) -> PlaylistChange:
+    """Remove a song from a specific playlist; the change holds the removed song, if it was in it."""
+    result = await db.execute(remove_songs_statement(playlist_id, [song_id]))
+    return await _commit_change_async(db, playlist_id, result.scalars().all())
+
+async def add_songs_to_playlist_async(db: AsyncSession, playlist_id: int, song_ids: List[int]) -> PlaylistChange:
+    """Add several songs to a specific playlist in one statement; the change holds the songs that were added."""
+    if not song_ids:
+        return PlaylistChange()
+    result = await db.execute(add_songs_statement(playlist_id, song_ids))
+    return await _commit_change_async(db, playlist_id, result.scalars().all())
+
+async def remove_songs_from_playlist_async(db: AsyncSession, playlist_id: int, song_ids: List[int]) -> PlaylistChange:
+    """Remove several songs from a specific playlist in one statement; the change holds the removed songs."""
+    if not song_ids:
+        return PlaylistChange()
+    result = await db.execute(remove_songs_statement(playlist_id, song_ids))
+    return await _commit_change_async(db, playlist_id, result.scalars().all())
+
+async def replace_playlist_songs_async(db: AsyncSession, playlist_id: int, song_ids: List[int]) -> PlaylistChange:
+    """Replace the songs of a specific playlist, in the given order, in one statement; the change holds its
+    new songs."""
+    if not song_ids:
+        return PlaylistChange([], await clear_playlist_async(db, playlist_id))
+    result = await db.execute(replace_songs_statement(playlist_id, song_ids))
+    songs = result.scalars().all()
+    version = await _bump_version_async(db, playlist_id)
+    await db.commit()
+    return PlaylistChange(songs, version)
+
+async def clear_playlist_async(db: AsyncSession, playlist_id: int) -> Optional[int]:
+    """Clear all songs from a specific playlist and return its new version, or None if it had no songs."""
+    result = await db.execute(clear_songs_statement(playlist_id))
+    version = await _bump_version_async(db, playlist_id) if result.rowcount else None
+    await db.commit()
+    return version
+
+async def get_song_at_index_async(
+    db: AsyncSession, playlist_id: int, index: int, from_end: bool = False
+) -> Optional[SongModel]:
+    """Get the song at a 0-based index of a playlist, counted from the end with from_end."""
+    result = await db.execute(song_at_index_statement(playlist_id, index, from_end))
+    return result.scalars().first()
+
+async def remove_songs_at_index_async(
+    db: AsyncSession, playlist_id: int, index: int, count: int = 1, from_end: bool = False
+) -> PlaylistChange:
+    """Remove count songs starting at a 0-based index of a playlist (e.g. the first or last N)."""
+    result = await db.execute(remove_songs_at_index_statement(playlist_id, index, count, from_end))
+    return await _commit_change_async(db, playlist_id, result.scalars().all())
+
+async def move_song_in_playlist_async(db: AsyncSession, playlist_id: int, song_id: int, index: int) -> Optional[int]:
+    """Move a song of a playlist to a 0-based index and return the new playlist version, or None if the
+    song is not in the playlist.
+
+    The song takes a position key between its new neighbours. Only when two neighbouring keys leave no
+    room between them is the playlist renumbered.
+    """
+    for attempt in range(2):
+        result = await db.execute(neighbour_positions_statement(playlist_id, song_id, index))
+        neighbours = result.scalars().all()
+
+        if index == 0 and neighbours:
+            position = neighbours[0] - PLAYLIST_POSITION_GAP
+        elif len(neighbours) == 2:
+            position = (neighbours[0] + neighbours[1]) // 2
+            if position == neighbours[0] and attempt == 0:
+                await db.execute(renumber_positions_statement(playlist_id))
+                continue
+        else:
+            position = None  # At or past the end: take a fresh key after every other song
+        break
+
+    result = await db.execute(set_position_statement(playlist_id, song_id, position))
+    version = await _bump_version_async(db, playlist_id) if result.rowcount else None
+    await db.commit()
+    return version
+
+async def get_songs_by_name_async(db: AsyncSession, song_name: str) -> List[SongModel]:
+    """Get a list of songs based on the song title."""
+    if not song_name:
+        return []
+    result = await db.execute(select(SongModel).filter(SongModel.title.ilike(f"%{song_name}%")))
+    return result.scalars().all()
+
+async def get_songs_by_album_async(db: AsyncSession, album_name: str) -> List[SongModel]:
+    """Get a list of songs based on the album name."""
+    if not album_name:
+        return []
+    result = await db.execute(select(SongModel).filter(SongModel.album.ilike(f"%{album_name}%")))
+    return result.scalars().all()
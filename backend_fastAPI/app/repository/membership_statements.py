@@ -0,0 +1,157 @@
+from typing import Optional, Sequence
+from sqlalchemy import Integer, column, delete, literal, select, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from ..models import PLAYLIST_POSITION_GAP, PlaylistModel, PlaylistPositionSequence, PlaylistSongsTable, SongModel
+
+# Single-statement playlist membership changes shared by the sync and async repositories.
+# Each statement modifies playlist_songs in a data-modifying CTE and selects the affected song rows,
+# so its cost does not depend on the size of the playlist. Song lists must not be empty.
+# Callers bump the playlist version in the same transaction whenever the membership changed.
+
+
+def _playlist_exists(playlist_id: int):
+    return select(PlaylistModel.id).where(PlaylistModel.id == playlist_id).exists()
+
+
+def _requested_songs(song_ids: Sequence[int]):
+    """VALUES list of the requested song ids with their order, without duplicates."""
+    unique_ids = list(dict.fromkeys(song_ids))
+    return values(column("song_id", Integer), column("ordinality", Integer), name="requested_songs").data(
+        [(song_id, i) for i, song_id in enumerate(unique_ids)]
+    )
+
+
+def _insert_songs_cte(playlist_id: int, song_ids: Sequence[int], reorder_existing: bool = False):
+    """Insert the existing songs in the requested order; positions come from the column default.
+
+    With `reorder_existing`, songs already in the playlist take the new position of their row as well.
+    """
+    requested = _requested_songs(song_ids)
+    rows = (
+        select(literal(playlist_id, Integer), SongModel.id)
+        .join(requested, requested.c.song_id == SongModel.id)
+        .where(_playlist_exists(playlist_id))
+        .order_by(requested.c.ordinality)
+    )
+    insert = pg_insert(PlaylistSongsTable).from_select(["playlist_id", "song_id"], rows)
+    if reorder_existing:
+        insert = insert.on_conflict_do_update(
+            index_elements=[PlaylistSongsTable.c.playlist_id, PlaylistSongsTable.c.song_id],
+            set_={"position": insert.excluded.position},
+        )
+    else:
+        insert = insert.on_conflict_do_nothing()
+    return insert.returning(PlaylistSongsTable.c.song_id, PlaylistSongsTable.c.position).cte("inserted_songs")
+
+
+def _songs_of(changed):
+    return select(SongModel).join(changed, SongModel.id == changed.c.song_id).order_by(changed.c.position)
+
+
+def add_songs_statement(playlist_id: int, song_ids: Sequence[int]):
+    """Append the songs that exist and are not in the playlist yet, selecting the songs that were added."""
+    return _songs_of(_insert_songs_cte(playlist_id, song_ids))
+
+
+def remove_songs_statement(playlist_id: int, song_ids: Sequence[int]):
+    """Delete the songs from the playlist, selecting the songs that were removed."""
+    deleted = (
+        delete(PlaylistSongsTable)
+        .where(PlaylistSongsTable.c.playlist_id == playlist_id, PlaylistSongsTable.c.song_id.in_(song_ids))
+        .returning(PlaylistSongsTable.c.song_id, PlaylistSongsTable.c.position)
+        .cte("removed_songs")
+    )
+    return _songs_of(deleted)
+
+
+def replace_songs_statement(playlist_id: int, song_ids: Sequence[int]):
+    """Make the playlist contain exactly the given (existing) songs in the given order, selecting its new songs.
+
+    Songs that stay in the playlist are only moved, never deleted, so the delete and the upsert of the
+    statement never touch the same row.
+    """
+    deleted = (
+        delete(PlaylistSongsTable)
+        .where(PlaylistSongsTable.c.playlist_id == playlist_id, PlaylistSongsTable.c.song_id.not_in(song_ids))
+        .cte("replaced_songs")
+    )
+    requested = _requested_songs(song_ids)
+    songs = (
+        select(SongModel.__table__)
+        .add_cte(deleted)
+        .add_cte(_insert_songs_cte(playlist_id, song_ids, reorder_existing=True))
+        .join(requested, requested.c.song_id == SongModel.id)
+        .where(_playlist_exists(playlist_id))
+        .order_by(requested.c.ordinality)
+    )
+    # ORM selects drop CTEs that they do not reference, so the rows are selected in Core and mapped afterwards
+    return select(SongModel).from_statement(songs)
+
+
+def clear_songs_statement(playlist_id: int):
+    return delete(PlaylistSongsTable).where(PlaylistSongsTable.c.playlist_id == playlist_id)
+
+
+def bump_version_statement(playlist_id: int):
+    """Increment the version of a playlist, selecting the new version."""
+    return (
+        update(PlaylistModel)
+        .where(PlaylistModel.id == playlist_id)
+        .values(version=PlaylistModel.version + 1)
+        .returning(PlaylistModel.version)
+    )
+
+
+def _positions_in_order(playlist_id: int, from_end: bool = False):
+    """Membership rows of a playlist in playlist order (or reversed), walked through the position index."""
+    position, song_id = PlaylistSongsTable.c.position, PlaylistSongsTable.c.song_id
+    return (
+        select(song_id, position)
+        .where(PlaylistSongsTable.c.playlist_id == playlist_id)
+        .order_by(*((position.desc(), song_id.desc()) if from_end else (position, song_id)))
+    )
+
+
+def song_at_index_statement(playlist_id: int, index: int, from_end: bool = False):
+    """Select the song at a 0-based index of the playlist, counted from the end with `from_end`."""
+    row = _positions_in_order(playlist_id, from_end).offset(index).limit(1).subquery()
+    return select(SongModel).join(row, SongModel.id == row.c.song_id)
+
+
+def remove_songs_at_index_statement(playlist_id: int, index: int, count: int, from_end: bool = False):
+    """Delete `count` songs starting at a 0-based index of the playlist, selecting the songs that were removed."""
+    targets = _positions_in_order(playlist_id, from_end).offset(index).limit(count).with_only_columns(
+        PlaylistSongsTable.c.song_id
+    )
+    return remove_songs_statement(playlist_id, targets)
+
+
+def neighbour_positions_statement(playlist_id: int, song_id: int, index: int):
+    """Select the positions around a 0-based index of the playlist, not counting the given song."""
+    rows = _positions_in_order(playlist_id).where(PlaylistSongsTable.c.song_id != song_id)
+    return rows.with_only_columns(PlaylistSongsTable.c.position).offset(max(index - 1, 0)).limit(2 if index else 1)
+
+
+def _next_position():
+    return PlaylistPositionSequence.next_value() * PLAYLIST_POSITION_GAP
+
+
+def set_position_statement(playlist_id: int, song_id: int, position: Optional[int] = None):
+    """Move a song to a position key; without one it takes a fresh key after every song of the playlist."""
+    return (
+        update(PlaylistSongsTable)
+        .where(PlaylistSongsTable.c.playlist_id == playlist_id, PlaylistSongsTable.c.song_id == song_id)
+        .values(position=_next_position() if position is None else position)
+    )
+
+
+def renumber_positions_statement(playlist_id: int):
+    """Spread the positions of a playlist evenly again with fresh sequence keys, keeping its order."""
+    ordered = _positions_in_order(playlist_id).subquery()
+    renumbered = select(ordered.c.song_id, _next_position().label("position")).subquery()
+    return (
+        update(PlaylistSongsTable)
+        .where(PlaylistSongsTable.c.playlist_id == playlist_id, PlaylistSongsTable.c.song_id == renumbered.c.song_id)
+        .values(position=renumbered.c.position)
+    )
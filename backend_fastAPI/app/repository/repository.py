@@ -1,14 +1,23 @@
 import random
-from typing import Optional, List
-from sqlalchemy import and_, or_
-from sqlalchemy.orm import Session
-from rapidfuzz import process
-
+from typing import Any, Dict, Iterator, Optional, List, Sequence
+import numpy as np
+from sqlalchemy import and_, func, or_, select
+from sqlalchemy.orm import Session, selectinload
+
+from app.catalog import (
+    FeatureRule, SongCatalog, acoustic_index_service, artist_dictionary_service, description_rule_clauses,
+    get_song_catalog, title_index_service,
+)
 from app.init_db import seed_db_demo
 from app.utils import advanced_normalize_text
-from ..models import PlaylistModel, SongModel
+from ..models import PlaylistModel, PlaylistSongsTable, SongModel
+from ..schemas import SongSchema
+from .membership_statements import (
+    add_songs_statement, bump_version_statement, clear_songs_statement, remove_songs_statement,
+)
 
 MAX_NUM_SONGS_SEARCH = 10
+EXPORT_BATCH_SIZE = 2000  # Rows fetched per round trip from the server-side cursor when exporting
 RAPIDFUZZ_SCORE_CUTOFF = 70
 
 def create_playlist(db: Session, user_id: int):
@@ -25,89 +34,154 @@ def demo_seed_database(db: Session):
     seed_db_demo(db)
 
 def get_all_playlists(db: Session) -> List[PlaylistModel]:
-    """Retrieve all playlists from the database as raw models."""
-    return db.query(PlaylistModel).all()
+    """Retrieve all playlists from the database as raw models, with their songs loaded in one extra query."""
+    return db.query(PlaylistModel).options(selectinload(PlaylistModel.songs)).all()
 
 def get_all_songs(db: Session) -> List[SongModel]:
     """Retrieve all songs from the database as raw models."""
     return db.query(SongModel).all()
 
+def get_songs_page(
+    db: Session, fields: Sequence[str], after_id: Optional[int] = None, limit: int = MAX_NUM_SONGS_SEARCH
+) -> List[Dict[str, Any]]:
+    """Retrieve one keyset page of songs (ordered by id, after after_id) as dicts of the requested columns."""
+    query = db.query(*(getattr(SongModel, field) for field in fields))
+    if after_id is not None:
+        query = query.filter(SongModel.id > after_id)
+    return [row._asdict() for row in query.order_by(SongModel.id).limit(limit)]
+
+def iter_song_rows(db: Session, fields: Sequence[str], batch_size: int = EXPORT_BATCH_SIZE) -> Iterator[List[tuple]]:
+    """Stream the songs table in id order from a server-side cursor, one batch of row tuples at a time."""
+    result = db.execute(
+        select(*(getattr(SongModel, field) for field in fields))
+        .order_by(SongModel.id)
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    for batch in result.partitions():
+        yield batch
+
+def get_playlists_page(
+    db: Session,
+    fields: Sequence[str],
+    song_fields: Sequence[str],
+    after_id: Optional[int] = None,
+    limit: int = MAX_NUM_SONGS_SEARCH,
+) -> List[Dict[str, Any]]:
+    """Retrieve one keyset page of playlists as dicts; with "songs" in fields, their ordered songs are
+    fetched for the whole page in one query."""
+    query = db.query(*(getattr(PlaylistModel, field) for field in fields if field != "songs"))
+    if after_id is not None:
+        query = query.filter(PlaylistModel.id > after_id)
+    playlists = [row._asdict() for row in query.order_by(PlaylistModel.id).limit(limit)]
+    if "songs" not in fields or not playlists:
+        return playlists
+
+    songs_by_playlist: Dict[int, List[Dict[str, Any]]] = {playlist["id"]: [] for playlist in playlists}
+    rows = (
+        db.query(PlaylistSongsTable.c.playlist_id, *(getattr(SongModel, field) for field in song_fields))
+        .join(SongModel, SongModel.id == PlaylistSongsTable.c.song_id)
+        .filter(PlaylistSongsTable.c.playlist_id.in_(songs_by_playlist))
+        .order_by(PlaylistSongsTable.c.playlist_id, PlaylistSongsTable.c.position, PlaylistSongsTable.c.song_id)
+    )
+    for row in rows:
+        songs_by_playlist[row[0]].append(dict(zip(song_fields, row[1:])))
+    for playlist in playlists:
+        playlist["songs"] = songs_by_playlist[playlist["id"]]
+    return playlists
+
 def get_playlist(db: Session, playlist_id: int) -> Optional[PlaylistModel]:
-    """Retrieve a specific playlist by ID and return the raw model."""
-    return db.query(PlaylistModel).filter(PlaylistModel.id == playlist_id).first()
+    """Retrieve a specific playlist by ID and return the raw model, with its songs loaded."""
+    return (
+        db.query(PlaylistModel)
+        .options(selectinload(PlaylistModel.songs))
+        .filter(PlaylistModel.id == playlist_id)
+        .first()
+    )
 
-def get_search_songs_not_in_playlist(db: Session, playlist_id: int, search_field: str = "") -> List[SongModel]:
-    """Retrieve a maximum of 10 songs not in a specific playlist matching a search field."""
-    
-    # Create a query to fetch songs not in the specified playlist
-    query = db.query(SongModel).filter(~SongModel.playlists.any(id=playlist_id))
-
-    # If there's a search term, filter the query based on the search field
-    if search_field:
-        search = f"%{search_field.lower()}%"
-        query = query.filter(
-            (SongModel.title.ilike(search)) | 
-            (SongModel.artist.ilike(search))
+def get_playlist_version(db: Session, playlist_id: int) -> Optional[int]:
+    """Get the version of a specific playlist, or None if it does not exist."""
+    return db.query(PlaylistModel.version).filter(PlaylistModel.id == playlist_id).scalar()
+
+def get_playlist_summaries(
+    db: Session, playlist_id: Optional[int] = None, after_id: Optional[int] = None, limit: int = MAX_NUM_SONGS_SEARCH
+) -> List[Dict[str, Any]]:
+    """Summarise playlists (id, title, song count, total duration in seconds) with one aggregate query,
+    either a keyset page of them or the single playlist playlist_id."""
+    query = (
+        db.query(
+            PlaylistModel.id,
+            PlaylistModel.title,
+            func.count(PlaylistSongsTable.c.song_id).label("song_count"),
+            func.coalesce(func.sum(SongModel.duration), 0).label("total_duration"),
         )
+        .outerjoin(PlaylistSongsTable, PlaylistSongsTable.c.playlist_id == PlaylistModel.id)
+        .outerjoin(SongModel, SongModel.id == PlaylistSongsTable.c.song_id)
+        .group_by(PlaylistModel.id)
+        .order_by(PlaylistModel.id)
+    )
+    if playlist_id is not None:
+        query = query.filter(PlaylistModel.id == playlist_id)
+    elif after_id is not None:
+        query = query.filter(PlaylistModel.id > after_id)
+    return [row._asdict() for row in query.limit(limit)]
+
+def get_search_song_ids_not_in_playlist(db: Session, playlist_id: int, search_field: str = "") -> List[int]:
+    """Retrieve the ids of a maximum of 10 songs not in a specific playlist matching a search field, ranked by
+    relevance."""
+
+    # Anti-join against the playlist membership rows (served by the playlist_songs primary key)
+    query = (
+        db.query(SongModel.id)
+        .outerjoin(
+            PlaylistSongsTable,
+            and_(
+                PlaylistSongsTable.c.song_id == SongModel.id,
+                PlaylistSongsTable.c.playlist_id == playlist_id,
+            ),
+        )
+        .filter(PlaylistSongsTable.c.song_id.is_(None))
+    )
 
-    # Limit the query to 10 results
-    return query.limit(MAX_NUM_SONGS_SEARCH).all()
+    if not search_field:
+        return [row[0] for row in query.order_by(SongModel.id).limit(MAX_NUM_SONGS_SEARCH)]
 
-async def add_song_to_playlist_async(db: Session, playlist_id: int, song_id: int) -> Optional[SongModel]:
-    """Add a song to a specific playlist and return the added song."""
-    playlist = get_playlist(db, playlist_id)
-    song = db.query(SongModel).filter(SongModel.id == song_id).first()
-    
-    if playlist and song and song not in playlist.songs:
-        playlist.songs.append(song)
-        db.commit()
-        return song
-    return None
-
-def add_song_to_playlist(db: Session, playlist_id: int, song_id: int) -> Optional[SongModel]:
-    """Add a song to a specific playlist and return the added song."""
-    playlist = get_playlist(db, playlist_id)
-    song = db.query(SongModel).filter(SongModel.id == song_id).first()
+    # Match the normalized title and the artist; both predicates are served by the trigram GIN indexes
+    normalized_search = advanced_normalize_text(search_field) or search_field.lower()
+    query = query.filter(
+        or_(
+            SongModel.normalized_title.ilike(f"%{normalized_search}%"),
+            SongModel.artist.ilike(f"%{search_field}%"),
+        )
+    )
 
-    print("Song model inside: ", song)
+    # Rank by the best trigram word similarity of either field, the song id breaks ties
+    relevance = func.greatest(
+        func.word_similarity(normalized_search, SongModel.normalized_title),
+        func.word_similarity(search_field, SongModel.artist),
+    )
+    return [row[0] for row in query.order_by(relevance.desc(), SongModel.id).limit(MAX_NUM_SONGS_SEARCH)]
 
-    print(playlist)
-    print(playlist.songs)
-    
-    if playlist and song and song not in playlist.songs:
-        playlist.songs.append(song)
-        db.commit()
-        return song
-    return None
-
-async def remove_song_from_playlist_async(db: Session, playlist_id: int, song_id: int) -> Optional[SongModel]:
-    """Remove a song from a specific playlist and return the removed song."""
-    playlist = get_playlist(db, playlist_id)
-    song = db.query(SongModel).filter(SongModel.id == song_id).first()
-
-    if playlist and song and song in playlist.songs:
-        playlist.songs.remove(song)
-        db.commit()
-        return song
-    return None
+def add_song_to_playlist(db: Session, playlist_id: int, song_id: int) -> Optional[SongModel]:
+    """Add a song to a specific playlist and return the added song, or None if it was not added."""
+    song = db.execute(add_songs_statement(playlist_id, [song_id])).scalars().first()
+    if song:
+        db.execute(bump_version_statement(playlist_id))
+    db.commit()
+    return song
 
 def remove_song_from_playlist(db: Session, playlist_id: int, song_id: int) -> Optional[SongModel]:
-    """Remove a song from a specific playlist and return the removed song."""
-    playlist = get_playlist(db, playlist_id)
-    song = db.query(SongModel).filter(SongModel.id == song_id).first()
-
-    if playlist and song and song in playlist.songs:
-        playlist.songs.remove(song)
-        db.commit()
-        return song
-    return None
+    """Remove a song from a specific playlist and return the removed song, or None if it was not in it."""
+    song = db.execute(remove_songs_statement(playlist_id, [song_id])).scalars().first()
+    if song:
+        db.execute(bump_version_statement(playlist_id))
+    db.commit()
+    return song
 
 def clear_playlist(db: Session, playlist_id: int):
     """Clear all songs from a specific playlist."""
-    playlist = get_playlist(db, playlist_id)
-    if playlist:
-        playlist.songs = []
-        db.commit()
+    if db.execute(clear_songs_statement(playlist_id)).rowcount:
+        db.execute(bump_version_statement(playlist_id))
+    db.commit()
 
 def get_song_id(db: Session, song_description: dict) -> Optional[int]:
     """Get a song ID based on a description (title, artist, album, year)."""
@@ -164,15 +238,15 @@ def get_songs_by_artist(db: Session, artist_name: str) -> List[SongModel]:
     songs = db.query(SongModel).filter(SongModel.artist.ilike(f"%{artist_name}%")).all()
     if songs:
         return songs
-    else:
-        all_artists = db.query(SongModel.artist).distinct().all()
-        artist_names = [artist[0] for artist in all_artists] 
-
-        best_match = process.extractOne(artist_name, artist_names, score_cutoff=RAPIDFUZZ_SCORE_CUTOFF)
-        if best_match:
-            songs = db.query(SongModel).filter(SongModel.artist == best_match[0]).all()
-            return songs
-        return songs
+
+    # Fall back to fuzzy matching against the cached artist dictionary of the catalog
+    artist_dictionary = artist_dictionary_service.get(get_song_catalog(db))
+    best_match = artist_dictionary.match(artist_name, score_cutoff=RAPIDFUZZ_SCORE_CUTOFF)
+    if best_match is None:
+        return []
+
+    song_ids = artist_dictionary.song_ids(best_match)
+    return db.query(SongModel).filter(SongModel.id.in_(song_ids)).order_by(SongModel.id).all()
 
 def get_songs_by_album(db: Session, album_name: str) -> List[SongModel]:
     """Get a list of songs based on the album name."""
@@ -183,33 +257,33 @@ def get_songs_by_album(db: Session, album_name: str) -> List[SongModel]:
 
 
 def filter_and_rank_songs(
-    playlist_songs: List[SongModel],
-    songs_to_filter: List[SongModel],
+    catalog: SongCatalog,
+    playlist_indices: np.ndarray,
+    candidate_indices: np.ndarray,
     num_recommendations: int
-) -> List[SongModel]:
-    
-    filtered_songs = songs_to_filter
-    
-    # Extract artists, albums, and titles from the playlist songs
-    if playlist_songs:
-        artists = {song.artist for song in playlist_songs}
-        albums = {song.album for song in playlist_songs}
-        titles = {song.title for song in playlist_songs}
-
-        print("Inside filter and rank songs: ", artists, albums, titles)
-
-        # Filter the songs based on relaxed matching (at least one condition met)
-        filtered_songs = [
-            song for song in songs_to_filter
-            if (song.artist in artists or song.album in albums) and song.title not in titles
-        ]
-
-    print("Num filtered song in filter_and_rank_songs: ", len(filtered_songs))
-    if not filtered_songs:
-        return []
+) -> np.ndarray:
+    """Pick catalog rows sharing an artist or album with the playlist, returned as catalog row indices."""
+
+    filtered = candidate_indices
+
+    # Keep candidates by an artist or from an album of the playlist, but with a title not already in it
+    if len(playlist_indices):
+        artist_codes = catalog.artist_codes[playlist_indices]
+        album_codes = catalog.album_codes[playlist_indices]
+        title_codes = catalog.title_codes[playlist_indices]
 
-    # Rank the filtered songs by ID in descending order (higher IDs are better)
-    top_songs = sorted(filtered_songs, key=lambda song: song.id, reverse=False)[:num_recommendations * 5]
+        mask = (
+            np.isin(catalog.artist_codes[filtered], artist_codes)
+            | np.isin(catalog.album_codes[filtered], album_codes)
+        ) & ~np.isin(catalog.title_codes[filtered], title_codes)
+        filtered = filtered[mask]
+
+    print("Num filtered song in filter_and_rank_songs: ", len(filtered))
+    if not len(filtered):
+        return filtered
+
+    # Rank the filtered songs by ID in ascending order; catalog rows are sorted by id
+    top_songs = np.sort(filtered)[:num_recommendations * 5]
 
     print(f"Num top songs after sorting and limiting: {len(top_songs)}")
 
@@ -217,36 +291,139 @@ def filter_and_rank_songs(
     sample_size = min(num_recommendations, len(top_songs))
 
     # Randomly sample from the top-ranked songs for variety
-    final_selection = random.sample(top_songs, sample_size)
+    return np.random.choice(top_songs, size=sample_size, replace=False)
 
-    return final_selection
 
+def get_playlist_song_ids(db: Session, playlist_id: int) -> List[int]:
+    """Retrieve the ids of the songs in a playlist without loading the songs."""
+    rows = (
+        db.query(PlaylistSongsTable.c.song_id)
+        .filter(PlaylistSongsTable.c.playlist_id == playlist_id)
+        .order_by(PlaylistSongsTable.c.position, PlaylistSongsTable.c.song_id)
+        .all()
+    )
+    return [row[0] for row in rows]
 
 
 def get_recommendations_from_songs(
     db: Session,
     playlist_id: int,
-    songs: Optional[List[SongModel]] = None,
+    candidate_indices: Optional[np.ndarray] = None,
     num_recommendations: int = 10
-) -> List[SongModel]:
-    # Retrieve playlist songs from the database based on the given playlist_id
-    playlist = get_playlist(db, playlist_id)
-    playlist_songs = SongModel.list_to_dto(playlist.songs)
+) -> List[SongSchema]:
+    """Recommend songs for a playlist from the in-memory catalog, optionally restricted to given catalog rows."""
+    catalog = get_song_catalog(db)
+    playlist_indices = catalog.indices_for_ids(get_playlist_song_ids(db, playlist_id))
 
-    # Determine the set of songs to filter: either provided as input or query all songs from DB
-    if songs is None:
-        songs_to_filter = db.query(SongModel).all()
-    else:
-        songs_to_filter = songs
+    # Determine the set of songs to filter: either provided as input or the whole catalog
+    if candidate_indices is None:
+        candidate_indices = np.arange(len(catalog))
 
     # Use the helper function to filter and rank the songs
-    recommended_songs = filter_and_rank_songs(
-        playlist_songs=playlist_songs,
-        songs_to_filter=songs_to_filter,
+    recommended_indices = filter_and_rank_songs(
+        catalog=catalog,
+        playlist_indices=playlist_indices,
+        candidate_indices=candidate_indices,
         num_recommendations=num_recommendations
     )
 
-    return recommended_songs
+    return catalog.to_dtos(recommended_indices)
+
+
+def _similar_song_indices(
+    catalog: SongCatalog,
+    playlist_indices: np.ndarray,
+    num_recommendations: int,
+    per_seed: bool
+) -> List[int]:
+    """Catalog rows of the songs acoustically closest to the given playlist rows."""
+    # Without any seed songs fall back to the artist/album based recommendations
+    if not len(playlist_indices):
+        return filter_and_rank_songs(
+            catalog=catalog,
+            playlist_indices=playlist_indices,
+            candidate_indices=np.arange(len(catalog)),
+            num_recommendations=num_recommendations
+        ).tolist()
+
+    index = acoustic_index_service.get(catalog)
+    excluded = np.isin(catalog.title_codes, catalog.title_codes[playlist_indices])
+    seed_vectors = index.vectors[playlist_indices]
+
+    if not per_seed:
+        neighbours = index.search(seed_vectors.mean(axis=0), num_recommendations, excluded)[0]
+        return neighbours[neighbours >= 0].tolist()
+
+    # Every seed contributes its own nearest neighbours; take them round-robin, nearest first
+    per_seed_k = -(-num_recommendations // len(playlist_indices)) + 1
+    neighbours = index.search(seed_vectors, per_seed_k, excluded)
+    selected: List[int] = []
+    for row in neighbours.T.ravel():
+        if row >= 0 and row not in selected:
+            selected.append(int(row))
+        if len(selected) == num_recommendations:
+            break
+    return selected
+
+
+def recommend_similar_song_ids(
+    db: Session,
+    playlist_id: int,
+    num_recommendations: int = 10,
+    per_seed: bool = False
+) -> List[int]:
+    """Recommend the songs acoustically closest to a playlist, returning their ids.
+
+    By default the k nearest neighbours of the playlist centroid are returned. With `per_seed` every playlist
+    song is queried on its own in one batch and the neighbour lists are interleaved, which keeps some variety
+    for playlists mixing different styles. Songs of the playlist, or sharing a title with one, are skipped.
+    """
+    catalog = get_song_catalog(db)
+    playlist_indices = catalog.indices_for_ids(get_playlist_song_ids(db, playlist_id))
+    rows = _similar_song_indices(catalog, playlist_indices, num_recommendations, per_seed)
+    return catalog.ids[rows].tolist()
+
+
+def recommend_similar_songs(
+    db: Session,
+    playlist_id: int,
+    num_recommendations: int = 10,
+    per_seed: bool = False
+) -> List[SongSchema]:
+    """Recommend the songs acoustically closest to a playlist, see `recommend_similar_song_ids`."""
+    catalog = get_song_catalog(db)
+    playlist_indices = catalog.indices_for_ids(get_playlist_song_ids(db, playlist_id))
+    return catalog.to_dtos(_similar_song_indices(catalog, playlist_indices, num_recommendations, per_seed))
+
+
+def sample_songs_by_description(db: Session, rule: Optional[FeatureRule], playlist_length_minutes: int) -> List[SongModel]:
+    """Select random songs matching a playlist description rule entirely in the database.
+
+    The rule becomes indexed WHERE clauses, the playlist size is derived from one aggregate over the matches,
+    and the random pick is an index range scan on the songs' random sample key, so only the final songs
+    are loaded.
+    """
+    clauses = description_rule_clauses(rule)
+
+    num_matches, average_duration = (
+        db.query(func.count(SongModel.id), func.avg(SongModel.duration)).filter(*clauses).one()
+    )
+    print("Num songs matching the playlist description: ", num_matches)
+    if not num_matches:
+        return []
+
+    # Calculate how many songs fit in the requested playlist length
+    num_songs_needed = num_matches
+    if average_duration:
+        num_songs_needed = min(num_matches, int(playlist_length_minutes / (float(average_duration) / 60)))
+
+    # Take the songs following a random pivot in sample key order, wrapping around to the start if needed
+    pivot = random.random()
+    query = db.query(SongModel).filter(*clauses).order_by(SongModel.sample_key)
+    songs = query.filter(SongModel.sample_key >= pivot).limit(num_songs_needed).all()
+    if len(songs) < num_songs_needed:
+        songs += query.filter(SongModel.sample_key < pivot).limit(num_songs_needed - len(songs)).all()
+    return songs
 
 
 def find_fuzzy_song_matches(
@@ -261,33 +438,37 @@ def find_fuzzy_song_matches(
     # Normalize the input title for fuzzy matching
     normalized_title = advanced_normalize_text(title)
 
-    # Start the query with ilike to allow partial matches on the normalized title
-    query = db.query(SongModel).filter(SongModel.normalized_title.ilike(f"%{normalized_title}%"))
-    
-    if artist:
-        query = query.filter(SongModel.artist.ilike(f"%{artist}%"))
-    if album:
-        query = query.filter(SongModel.album.ilike(f"%{album}%"))
-    if year:
-        query = query.filter(SongModel.year == year)
-    
-    # Retrieve initial candidates using the ilike query (limiting to 50 for now)
-    candidates: List[SongModel] = query.limit(50).all()
+    # Apply the artist, album and year filters in SQL first, so that they restrict the candidates
+    # before the n-gram stage cuts them down to its limit
+    filtered_ids = None
+    if artist or album or year:
+        filtered = db.query(SongModel.id)
+        if artist:
+            filtered = filtered.filter(SongModel.artist.ilike(f"%{artist}%"))
+        if album:
+            filtered = filtered.filter(SongModel.album.ilike(f"%{album}%"))
+        if year:
+            filtered = filtered.filter(SongModel.year == year)
+        filtered_ids = [row[0] for row in filtered]
+        if not filtered_ids:
+            return []
+
+    # Generate candidates by n-gram overlap and fuzzy-score them
+    scored_ids = title_index_service.get(db).search(
+        normalized_title, score_cutoff=RAPIDFUZZ_SCORE_CUTOFF, song_ids=filtered_ids
+    )
 
-    print("Num fuzzy song matches candidates: ", len(candidates))
-    
-    # Normalize the titles of all candidates for better matching
-    candidate_titles = [advanced_normalize_text(c.title) for c in candidates]
-    
-    # Perform fuzzy matching using the normalized title
-    scored_candidates = process.extract(normalized_title, candidate_titles, score_cutoff=RAPIDFUZZ_SCORE_CUTOFF)
-    
-    # Map back to SongModel objects using the index of matches in scored_candidates
-    matched_songs = [candidates[idx] for _, score, idx in scored_candidates]
+    print("Num fuzzy song matches candidates: ", len(scored_ids))
+
+    if not scored_ids:
+        return []
+
+    scores = dict(scored_ids)
+    query = db.query(SongModel).filter(SongModel.id.in_(scores))
+
+    # Rank by match score first; among equal scores the song's id is treated as its rank
+    ranked_songs = sorted(query.all(), key=lambda song: (-scores[song.id], song.id))
 
-    # Now, we rank the songs based on their original position (id is treated as the rank)
-    ranked_songs = sorted(matched_songs, key=lambda song: song.id)
-    
     return ranked_songs[:MAX_NUM_SONGS_SEARCH]
 
 
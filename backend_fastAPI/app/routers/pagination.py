@@ -0,0 +1,22 @@
+from typing import Any, Dict, List, Optional, Sequence
+from fastapi import HTTPException, Response
+
+# Keyset pagination on ids: clients pass the id of the last row they saw as `after`,
+# the next cursor is returned in this header while more rows may follow
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+
+def parse_fields(fields: Optional[str], allowed: Sequence[str], default: Sequence[str]) -> List[str]:
+    """Parse a comma-separated `fields=` projection; the id is always included since it is the cursor."""
+    requested = [field.strip() for field in fields.split(",") if field.strip()] if fields else list(default)
+    unknown = [field for field in requested if field not in allowed]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ["id"] + [field for field in dict.fromkeys(requested) if field != "id"]
+
+
+def set_next_cursor(response: Response, rows: List[Dict[str, Any]], limit: int):
+    if len(rows) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = str(rows[-1]["id"])
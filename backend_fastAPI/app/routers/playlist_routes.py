@@ -1,66 +1,174 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
-from ..schemas import PlaylistSchema, SongSchema
+from ..schemas import PlaylistSchema, PlaylistSongIdsSchema, PlaylistSummarySchema, SongSchema
 from ..websocket import ws_push_playlist_update
-from ..database import get_db
+from ..database import get_async_db, get_db
+from ..serialization import JSONBytesResponse, playlist_json, rows_json, songs_json
+from .pagination import DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT, parse_fields, set_next_cursor
 import app.repository as r
 
 router = APIRouter()
 
-# Get all playlists
-@router.get("/playlists", response_model=List[PlaylistSchema])
-def read_all_playlists(db: Session = Depends(get_db)):
-    playlists = r.get_all_playlists(db)
-    # Convert SQLAlchemy models to Pydantic schema
-    return [PlaylistSchema.from_orm(playlist) for playlist in playlists]
+PLAYLIST_FIELDS = list(PlaylistSchema.__fields__)
+SONG_FIELDS = list(SongSchema.__fields__)
+
+
+def _playlist_etag(playlist_id: int, version: int) -> str:
+    return f'"{playlist_id}-{version}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an ETag against an If-None-Match header, as required for GET requests."""
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or etag in (candidate.removeprefix("W/") for candidate in candidates)
+
+
+# Get a page of playlists
+@router.get("/playlists")
+def read_all_playlists(after: Optional[int] = None,
+                       limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+                       fields: Optional[str] = None, song_fields: Optional[str] = None,
+                       db: Session = Depends(get_db)):
+    """Retrieve playlists after the `after` cursor, optionally projected to `fields` (e.g. `id,title`)
+    and `song_fields` for their songs. The next cursor is returned in the X-Next-Cursor header."""
+    playlist_fields = parse_fields(fields, PLAYLIST_FIELDS, PLAYLIST_FIELDS)
+    playlists = r.get_playlists_page(db, playlist_fields, parse_fields(song_fields, SONG_FIELDS, SONG_FIELDS),
+                                     after, limit)
+    response = JSONBytesResponse(rows_json(playlists))
+    set_next_cursor(response, playlists, limit)
+    return response
+
+# Get a page of playlist summaries
+@router.get("/playlists/summary", response_model=List[PlaylistSummarySchema])
+def read_playlist_summaries(response: Response, after: Optional[int] = None,
+                            limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+                            db: Session = Depends(get_db)):
+    """Retrieve the id, title, song count and total duration of playlists, without their songs."""
+    summaries = r.get_playlist_summaries(db, after_id=after, limit=limit)
+    set_next_cursor(response, summaries, limit)
+    return summaries
+
+# Get the summary of a specific playlist
+@router.get("/playlist/{playlist_id}/summary", response_model=PlaylistSummarySchema)
+def read_playlist_summary(playlist_id: int, db: Session = Depends(get_db)):
+    summaries = r.get_playlist_summaries(db, playlist_id=playlist_id, limit=1)
+    if not summaries:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    return summaries[0]
 
 # Get a specific playlist by its ID
 @router.get("/playlist/{playlist_id}", response_model=PlaylistSchema)
-def read_playlist(playlist_id: int, db: Session = Depends(get_db)):
-    playlist = r.get_playlist(db, playlist_id)
+def read_playlist(playlist_id: int, if_none_match: Optional[str] = Header(None), db: Session = Depends(get_db)):
+    """Retrieve a playlist with its songs. The response carries an ETag of the playlist version, and
+    a request whose If-None-Match still matches it gets an empty 304 Not Modified."""
+    version = r.get_playlist_version(db, playlist_id)
     # Handle the case where the playlist is not found
-    if not playlist:
-        return {"message": "Playlist not found"}
-    # Convert SQLAlchemy model to Pydantic schema
-    return PlaylistSchema.from_orm(playlist)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+
+    # Clients should revalidate every time, since the playlist changes whenever its songs do
+    headers = {"ETag": _playlist_etag(playlist_id, version), "Cache-Control": "no-cache"}
+    if _etag_matches(if_none_match, headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    # Served from the cache of serialized playlist versions, or assembled from cached song JSON fragments;
+    # a playlist changed since the version check is served, and tagged, at its newer version
+    playlist = playlist_json(db, playlist_id, version)
+    if playlist is None:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    version, content = playlist
+    headers["ETag"] = _playlist_etag(playlist_id, version)
+    return JSONBytesResponse(content, headers=headers)
 
 # Get all songs not in a specific playlist matching a searchfield
 @router.get("/playlist/{playlist_id}/songs_not_in", response_model=List[SongSchema])
 def read_songs_not_in_playlist(playlist_id: int, search: str = "", db: Session = Depends(get_db)):
     """Retrieve a maximum of 10 songs not in a specific playlist, optionally filtering by search term."""
-    songs = r.get_search_songs_not_in_playlist(db, playlist_id, search)
-    return [SongSchema.from_orm(song) for song in songs]
+    song_ids = r.get_search_song_ids_not_in_playlist(db, playlist_id, search)
+    return JSONBytesResponse(songs_json(db, song_ids))
+
+# Get songs acoustically similar to a specific playlist
+@router.get("/playlist/{playlist_id}/recommendations", response_model=List[SongSchema])
+def read_playlist_recommendations(playlist_id: int, k: int = Query(10, ge=1, le=100), per_seed: bool = False,
+                                  db: Session = Depends(get_db)):
+    """Retrieve the k songs closest to the playlist centroid, or to each of its songs with per_seed."""
+    song_ids = r.recommend_similar_song_ids(db, playlist_id, k, per_seed)
+    return JSONBytesResponse(songs_json(db, song_ids))
 
 # Add a song to a specific playlist
 @router.post("/playlist/{playlist_id}/add_song/{song_id}")
-async def add_song(playlist_id: int, song_id: int, db: Session = Depends(get_db)):
+async def add_song(playlist_id: int, song_id: int, db: AsyncSession = Depends(get_async_db)):
     # Add the song to the playlist
-    song = await r.add_song_to_playlist_async(db, playlist_id, song_id)
-    if not song:
+    change = await r.add_song_to_playlist_async(db, playlist_id, song_id)
+    if not change.song:
         raise HTTPException(status_code=404, detail="Song not found or already in the playlist")
     # Notify via WebSocket
-    await ws_push_playlist_update(playlist_id)
-    return SongSchema.from_orm(song)
+    await ws_push_playlist_update(playlist_id, change.version, added=change.songs)
+    return SongSchema.from_orm(change.song)
 
 # Remove a song from a specific playlist
 @router.post("/playlist/{playlist_id}/remove_song/{song_id}")
-async def remove_song(playlist_id: int, song_id: int, db: Session = Depends(get_db)):
+async def remove_song(playlist_id: int, song_id: int, db: AsyncSession = Depends(get_async_db)):
     # Remove the song from the playlist
-    song = await r.remove_song_from_playlist_async(db, playlist_id, song_id)
-    if not song:
+    change = await r.remove_song_from_playlist_async(db, playlist_id, song_id)
+    if not change.song:
         raise HTTPException(status_code=404, detail="Song not found in the playlist")
     # Notify via WebSocket
-    await ws_push_playlist_update(playlist_id)
-    return SongSchema.from_orm(song)
+    await ws_push_playlist_update(playlist_id, change.version, removed=change.songs)
+    return SongSchema.from_orm(change.song)
+
+# Move a song to another position of a specific playlist
+@router.post("/playlist/{playlist_id}/move_song/{song_id}")
+async def move_song(playlist_id: int, song_id: int, index: int = Query(..., ge=0),
+                    db: AsyncSession = Depends(get_async_db)):
+    """Move a song to a 0-based index of the playlist."""
+    version = await r.move_song_in_playlist_async(db, playlist_id, song_id, index)
+    if version is None:
+        raise HTTPException(status_code=404, detail="Song not found in the playlist")
+    # Notify via WebSocket; a reorder has no delta, clients refetch
+    await ws_push_playlist_update(playlist_id, version)
+    return {"message": "Song moved"}
+
+# Add several songs to a specific playlist
+@router.post("/playlist/{playlist_id}/songs", response_model=List[SongSchema])
+async def add_songs(playlist_id: int, body: PlaylistSongIdsSchema, db: AsyncSession = Depends(get_async_db)):
+    """Add the songs in one transaction and return the songs that were added."""
+    change = await r.add_songs_to_playlist_async(db, playlist_id, body.song_ids)
+    # Notify via WebSocket, once for the whole batch
+    if change.songs:
+        await ws_push_playlist_update(playlist_id, change.version, added=change.songs)
+    return [SongSchema.from_orm(song) for song in change.songs]
+
+# Remove several songs from a specific playlist
+@router.delete("/playlist/{playlist_id}/songs", response_model=List[SongSchema])
+async def remove_songs(playlist_id: int, body: PlaylistSongIdsSchema, db: AsyncSession = Depends(get_async_db)):
+    """Remove the songs in one transaction and return the songs that were removed."""
+    change = await r.remove_songs_from_playlist_async(db, playlist_id, body.song_ids)
+    # Notify via WebSocket, once for the whole batch
+    if change.songs:
+        await ws_push_playlist_update(playlist_id, change.version, removed=change.songs)
+    return [SongSchema.from_orm(song) for song in change.songs]
+
+# Replace the songs of a specific playlist
+@router.put("/playlist/{playlist_id}/songs", response_model=List[SongSchema])
+async def replace_songs(playlist_id: int, body: PlaylistSongIdsSchema, db: AsyncSession = Depends(get_async_db)):
+    """Make the playlist contain exactly the given songs in one transaction and return its new songs."""
+    change = await r.replace_playlist_songs_async(db, playlist_id, body.song_ids)
+    # Notify via WebSocket; a replacement has no delta, clients refetch
+    await ws_push_playlist_update(playlist_id, change.version)
+    return [SongSchema.from_orm(song) for song in change.songs]
 
 # Clear a playlist
 @router.post("/playlist/{playlist_id}/clear")
-async def clear_playlist_async(playlist_id: int, db: Session = Depends(get_db)):
+async def clear_playlist_async(playlist_id: int, db: AsyncSession = Depends(get_async_db)):
     # Clear all songs from the playlist
-    r.clear_playlist(db, playlist_id)
-    playlist = r.get_playlist(db, playlist_id)
+    version = await r.clear_playlist_async(db, playlist_id)
+    playlist = await r.get_playlist_async(db, playlist_id)
     # Notify via WebSocket
-    await ws_push_playlist_update(playlist_id)
+    await ws_push_playlist_update(playlist_id, version)
     return PlaylistSchema.from_orm(playlist)
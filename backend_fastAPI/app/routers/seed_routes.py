@@ -1,18 +1,32 @@
 import os
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
+from ..catalog import acoustic_index_service, entity_linker_service, song_catalog
+from ..catalog_events import publish_catalog_invalidated
 from ..init_db import seed_db_demo, seed_db_dataset_sqlite
 from ..database import get_db
 from ..rasa_data import save_data_to_disk
 
 router = APIRouter()
 
+
+def _seed_dataset_and_warm_catalog(db: Session, db_file_path: str):
+    seed_db_dataset_sqlite(db, db_file_path)
+
+    # Warm the in-memory song catalog with the freshly seeded songs and rebuild the similarity index
+    catalog = song_catalog.refresh(db)
+    acoustic_index_service.rebuild(catalog)
+    entity_linker_service.rebuild_in_background(catalog)
+
+
 # Endpoint to seed the database
 @router.post("/seed/demo")
-def seed_database_demo(db: Session = Depends(get_db)):
+async def seed_database_demo(db: Session = Depends(get_db)):
     try:
-        seed_db_demo(db)  # Seed the database with demo data
+        await run_in_threadpool(seed_db_demo, db)  # Seed the database with demo data
+        await publish_catalog_invalidated()
         return {"message": "Database seeded successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -20,7 +34,7 @@ def seed_database_demo(db: Session = Depends(get_db)):
 
 # Endpoint to seed the database
 @router.post("/seed/dataset")
-def seed_database_dataset(db: Session = Depends(get_db)):
+async def seed_database_dataset(db: Session = Depends(get_db)):
     try:
          # Get the absolute path to the SQLite file
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -30,8 +44,9 @@ def seed_database_dataset(db: Session = Depends(get_db)):
         if not db_file_path:
             raise Exception("No dataset file")
 
-        # Seed the database using the absolute path
-        seed_db_dataset_sqlite(db, db_file_path)
+        # Seed the database using the absolute path, then have the other workers drop their catalog caches
+        await run_in_threadpool(_seed_dataset_and_warm_catalog, db, db_file_path)
+        await publish_catalog_invalidated()
 
         return {"message": "Database seeded successfully"}
     except Exception as e:
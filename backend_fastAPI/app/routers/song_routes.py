@@ -1,19 +1,47 @@
-from fastapi import APIRouter, Depends, Request
+from fastapi import APIRouter, Depends, Query, Request
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
-from typing import List
+from typing import Iterator, List, Optional
 
 from ..schemas import SongSchema
-from ..database import get_db
-from ..repository import get_song_by_song_description, get_all_songs
+from ..database import SessionLocal, get_db
+from ..repository import get_song_by_song_description, get_songs_page, iter_song_rows
+from ..serialization import JSONBytesResponse, encode_row, rows_json
+from .pagination import DEFAULT_PAGE_LIMIT, MAX_PAGE_LIMIT, parse_fields, set_next_cursor
 
 router = APIRouter()
 
-# Get all songs in the database
-@router.get("/songs", response_model=List[SongSchema])
-def read_all_songs(db: Session = Depends(get_db)):
-    songs = get_all_songs(db)
-    print(songs[0:20])
-    return [SongSchema.from_orm(song) for song in songs]
+SONG_FIELDS = list(SongSchema.__fields__)
+
+# Get a page of songs in the database
+@router.get("/songs")
+def read_all_songs(after: Optional[int] = None,
+                   limit: int = Query(DEFAULT_PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+                   fields: Optional[str] = None, db: Session = Depends(get_db)):
+    """Retrieve songs after the `after` cursor, optionally projected to `fields` (e.g. `id,title,artist`).
+    The next cursor is returned in the X-Next-Cursor header."""
+    songs = get_songs_page(db, parse_fields(fields, SONG_FIELDS, SONG_FIELDS), after, limit)
+    response = JSONBytesResponse(rows_json(songs))
+    set_next_cursor(response, songs, limit)
+    return response
+
+
+def _songs_ndjson(fields: List[str]) -> Iterator[bytes]:
+    # The generator owns its session, since it keeps reading after the endpoint has returned
+    db = SessionLocal()
+    try:
+        for batch in iter_song_rows(db, fields):
+            yield b"".join(encode_row(fields, row) + b"\n" for row in batch)
+    finally:
+        db.close()
+
+# Stream all songs in the database as newline-delimited JSON
+@router.get("/songs/export")
+def export_all_songs(fields: Optional[str] = None):
+    """Stream every song, optionally projected to `fields`, as one JSON object per line."""
+    return StreamingResponse(
+        _songs_ndjson(parse_fields(fields, SONG_FIELDS, SONG_FIELDS)), media_type="application/x-ndjson"
+    )
 
 
 # Simulate playlist update and broadcast it to all connected clients
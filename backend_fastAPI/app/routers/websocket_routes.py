@@ -1,9 +1,8 @@
 import json
-from fastapi import APIRouter, Depends, WebSocket, WebSocketDisconnect
-from requests import Session
+from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
+from app.chat_agent import default_nlu_client
 from app.chat_mediator import ChatWSMediator
-from ..database import get_db
 from ..websocket import ws_manager_playlist
 
 
@@ -15,12 +14,21 @@ async def playlist_websocket_endpoint(websocket: WebSocket):
     await ws_manager_playlist.connect(websocket)
     try:
         while True:
-            await websocket.receive_text()  # Keep the connection alive
+            # Subscription changes; other messages just keep the connection alive
+            ws_manager_playlist.handle_message(websocket, await websocket.receive_text())
     except WebSocketDisconnect:
+        pass
+    finally:
         ws_manager_playlist.disconnect(websocket)
 
 
 @router.websocket("/ws/chat/{user_id}")
-async def chat_websocket_endpoint(user_id: int, websocket: WebSocket, db: Session = Depends(get_db)):
-    chat_handler = ChatWSMediator(user_id, websocket, db)
+async def chat_websocket_endpoint(user_id: int, websocket: WebSocket):
+    chat_handler = ChatWSMediator(user_id, websocket)
     await chat_handler.handle_connection()
+
+
+# Fast-path and parse cache counters of the NLU pipeline used by the chat agents
+@router.get("/chat/nlu/stats")
+def read_nlu_stats():
+    return default_nlu_client.stats()
@@ -33,8 +33,17 @@ class SongSchema(SongSchemaBase):
     class Config:
         orm_mode = True
 
+class PlaylistSongIdsSchema(BaseModel):
+    song_ids: List[int]
+
+class PlaylistSummarySchema(PlaylistSchemaBase):
+    id: int
+    song_count: int
+    total_duration: int  # Seconds
+
 class PlaylistSchema(PlaylistSchemaBase):
     id: int
+    version: int = 0
     songs: List[SongSchema] = []
 
     class Config:
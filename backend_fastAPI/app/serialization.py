@@ -0,0 +1,144 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import orjson
+from fastapi import Response
+from sqlalchemy.orm import Session
+
+from .models import PlaylistModel, PlaylistSongsTable, SongModel
+from .schemas import SongSchema
+
+# Song payloads are encoded straight from row tuples with orjson, without pydantic objects.
+# Encoded songs are cached as JSON fragments, so large responses are assembled by concatenation.
+
+SONG_JSON_FIELDS = list(SongSchema.__fields__)
+SONG_JSON_CACHE_MAX_ENTRIES = 100_000
+PLAYLIST_JSON_CACHE_MAX_ENTRIES = 256
+
+
+def encode_row(fields: Sequence[str], row: Sequence[Any]) -> bytes:
+    """Encode a row tuple as a JSON object with the given field names."""
+    return orjson.dumps(dict(zip(fields, row)))
+
+
+def json_array(fragments: Iterable[bytes]) -> bytes:
+    return b"[" + b",".join(fragments) + b"]"
+
+
+class JSONBytesResponse(Response):
+    """Response for content that is already encoded JSON."""
+
+    media_type = "application/json"
+
+
+class SongJSONCache:
+    """LRU cache of encoded songs (all SongSchema fields) keyed by song id.
+
+    Misses are loaded with one query of row tuples. Songs are immutable once seeded, so the cache only has
+    to be cleared when the songs table is reseeded.
+    """
+
+    def __init__(self, max_entries: int = SONG_JSON_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._fragments: "OrderedDict[int, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, db: Session, song_ids: Sequence[int]) -> List[bytes]:
+        """Encoded songs in the order of song_ids; ids of songs that do not exist are skipped."""
+        with self._lock:
+            found = {song_id: self._fragments.get(song_id) for song_id in song_ids}
+            for song_id, fragment in found.items():
+                if fragment is not None:
+                    self._fragments.move_to_end(song_id)
+
+        missing = [song_id for song_id, fragment in found.items() if fragment is None]
+        if missing:
+            columns = [getattr(SongModel, field) for field in SONG_JSON_FIELDS]
+            rows = db.query(*columns).filter(SongModel.id.in_(missing)).all()
+            loaded = {row.id: encode_row(SONG_JSON_FIELDS, row) for row in rows}
+            found.update(loaded)
+            with self._lock:
+                self._fragments.update(loaded)
+                while len(self._fragments) > self.max_entries:
+                    self._fragments.popitem(last=False)
+
+        return [found[song_id] for song_id in song_ids if found.get(song_id) is not None]
+
+    def invalidate(self):
+        with self._lock:
+            self._fragments.clear()
+
+
+song_json_cache = SongJSONCache()
+
+
+def songs_json(db: Session, song_ids: Sequence[int]) -> bytes:
+    """JSON array of the given songs, in order."""
+    return json_array(song_json_cache.get_many(db, song_ids))
+
+
+class PlaylistJSONCache:
+    """LRU cache of encoded playlists keyed by (playlist id, version).
+
+    A version identifies the songs of a playlist, so entries never go stale while the songs table is unchanged;
+    older versions of a playlist are simply evicted.
+    """
+
+    def __init__(self, max_entries: int = PLAYLIST_JSON_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._playlists: "OrderedDict[Tuple[int, int], bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, playlist_id: int, version: int) -> Optional[bytes]:
+        with self._lock:
+            content = self._playlists.get((playlist_id, version))
+            if content is not None:
+                self._playlists.move_to_end((playlist_id, version))
+            return content
+
+    def put(self, playlist_id: int, version: int, content: bytes):
+        with self._lock:
+            self._playlists[(playlist_id, version)] = content
+            while len(self._playlists) > self.max_entries:
+                self._playlists.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._playlists.clear()
+
+
+playlist_json_cache = PlaylistJSONCache()
+
+
+def playlist_json(db: Session, playlist_id: int, version: int) -> Optional[Tuple[int, bytes]]:
+    """Version and JSON object of a playlist in the PlaylistSchema shape, or None if the playlist does not exist.
+
+    `version` is the version the caller last read, which is served from the cache if possible. Otherwise the
+    version and the songs are read together in one statement, so they come from the same snapshot; the
+    returned version may then be newer than the requested one.
+    """
+    content = playlist_json_cache.get(playlist_id, version)
+    if content is not None:
+        return version, content
+
+    rows = (
+        db.query(PlaylistModel.id, PlaylistModel.title, PlaylistModel.version, PlaylistSongsTable.c.song_id)
+        .outerjoin(PlaylistSongsTable, PlaylistSongsTable.c.playlist_id == PlaylistModel.id)
+        .filter(PlaylistModel.id == playlist_id)
+        .order_by(PlaylistSongsTable.c.position, PlaylistSongsTable.c.song_id)
+        .all()
+    )
+    if not rows:
+        return None
+
+    playlist = rows[0]
+    song_ids = [row.song_id for row in rows if row.song_id is not None]
+    header = orjson.dumps({"id": playlist.id, "title": playlist.title, "version": playlist.version})
+    content = header[:-1] + b',"songs":' + songs_json(db, song_ids) + b"}"
+    playlist_json_cache.put(playlist_id, playlist.version, content)
+    return playlist.version, content
+
+
+def rows_json(rows: List[Dict[str, Any]]) -> bytes:
+    return orjson.dumps(rows)
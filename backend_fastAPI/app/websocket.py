@@ -1,22 +1,223 @@
+import asyncio
 import json
 from fastapi import WebSocket
-from typing import List, Dict
+from typing import Any, Dict, Iterable, Optional, Sequence, Set
+
+from .event_broker import event_broker
+
+WS_SEND_QUEUE_SIZE = 32  # Messages waiting for a playlist socket before it is dropped as a slow consumer
+WS_SEND_TIMEOUT_SECONDS = 5
+WS_CLOSE_TRY_AGAIN_LATER = 1013
+
+# Broker channels through which playlist updates and chat messages reach the sockets of every worker
+PLAYLIST_UPDATES_CHANNEL = "playlist_updates"
+CHAT_MESSAGES_CHANNEL = "chat_messages"
+
+# Song fields carried by the songs added in a playlist update; those of a playlist row in the frontend
+PLAYLIST_DELTA_SONG_FIELDS = ("id", "title", "artist", "album", "year")
+
+# Changes of a playlist are pushed once no further change arrived for the window, or at the latest after
+# the max delay from the first change of a burst, as one update with the combined delta
+PLAYLIST_UPDATE_WINDOW_SECONDS = 0.05
+PLAYLIST_UPDATE_MAX_DELAY_SECONDS = 0.25
+
+
+class PlaylistWSConnection:
+    """A playlist socket with its subscriptions and its own bounded send queue, drained by a sender task."""
+
+    def __init__(self, websocket: WebSocket):
+        self.websocket = websocket
+        self.playlist_ids: Optional[Set[int]] = None  # None until the first subscribe: every playlist
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+        self.sender: Optional[asyncio.Task] = None
+        self.dropped = False
+
 
 # Playlist connection manager
 class PlaylistWSConnectionManager:
+    """Fans playlist updates out to the sockets subscribed to the playlist.
+
+    Clients send {"action": "subscribe" | "unsubscribe", "playlist_ids": [...]}; sockets that never
+    subscribed receive the updates of every playlist. Publishing only enqueues, so one slow or dead socket
+    never delays the others: a socket whose queue is full or whose send times out is disconnected.
+    """
+
     def __init__(self):
-        self.active_connections: List[WebSocket] = []
+        self.active_connections: Dict[WebSocket, PlaylistWSConnection] = {}
+        self._subscribers: Dict[int, Set[PlaylistWSConnection]] = {}
+        self._unsubscribed: Set[PlaylistWSConnection] = set()
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
-        self.active_connections.append(websocket)
+        connection = PlaylistWSConnection(websocket)
+        connection.sender = asyncio.create_task(self._send_loop(connection))
+        self.active_connections[websocket] = connection
+        self._unsubscribed.add(connection)
 
     def disconnect(self, websocket: WebSocket):
-        self.active_connections.remove(websocket)
+        connection = self.active_connections.pop(websocket, None)
+        if connection is None:
+            return
+        self._unsubscribed.discard(connection)
+        for playlist_id in connection.playlist_ids or ():
+            self._discard_subscriber(playlist_id, connection)
+        if connection.sender is not asyncio.current_task():
+            connection.sender.cancel()
+
+    def subscribe(self, websocket: WebSocket, playlist_ids: Iterable[int]):
+        connection = self.active_connections.get(websocket)
+        if connection is None:
+            return
+        if connection.playlist_ids is None:
+            connection.playlist_ids = set()
+            self._unsubscribed.discard(connection)
+        for playlist_id in playlist_ids:
+            connection.playlist_ids.add(playlist_id)
+            self._subscribers.setdefault(playlist_id, set()).add(connection)
+
+    def unsubscribe(self, websocket: WebSocket, playlist_ids: Iterable[int]):
+        """Remove subscriptions; a socket that never subscribed keeps receiving every playlist."""
+        connection = self.active_connections.get(websocket)
+        if connection is None or connection.playlist_ids is None:
+            return
+        for playlist_id in playlist_ids:
+            connection.playlist_ids.discard(playlist_id)
+            self._discard_subscriber(playlist_id, connection)
+
+    def handle_message(self, websocket: WebSocket, text: str):
+        """Apply a subscription message from a client; anything else (e.g. keep-alive pings) is ignored."""
+        try:
+            message = json.loads(text)
+            action = message["action"]
+            playlist_ids = [int(playlist_id) for playlist_id in message["playlist_ids"]]
+        except (ValueError, TypeError, KeyError):
+            return
+        if action == "subscribe":
+            self.subscribe(websocket, playlist_ids)
+        elif action == "unsubscribe":
+            self.unsubscribe(websocket, playlist_ids)
+
+    def publish(self, playlist_id: int, message: str):
+        """Queue a message for the sockets interested in a playlist, without waiting for any of them."""
+        for connection in self._unsubscribed | self._subscribers.get(playlist_id, set()):
+            try:
+                connection.queue.put_nowait(message)
+            except asyncio.QueueFull:
+                print(f"Dropping slow playlist WebSocket consumer ({WS_SEND_QUEUE_SIZE} messages pending).")
+                connection.dropped = True
+                self.disconnect(connection.websocket)
+
+    def _discard_subscriber(self, playlist_id: int, connection: PlaylistWSConnection):
+        subscribers = self._subscribers.get(playlist_id)
+        if subscribers is not None:
+            subscribers.discard(connection)
+            if not subscribers:
+                del self._subscribers[playlist_id]
+
+    async def _send_loop(self, connection: PlaylistWSConnection):
+        websocket = connection.websocket
+        try:
+            while True:
+                message = await connection.queue.get()
+                await asyncio.wait_for(websocket.send_text(message), WS_SEND_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            if not connection.dropped:
+                return  # The client disconnected
+        except Exception as e:
+            print(f"Dropping playlist WebSocket after a failed send: {e!r}")
+            self.disconnect(websocket)
+
+        try:
+            await websocket.close(code=WS_CLOSE_TRY_AGAIN_LATER)
+        except Exception:
+            pass  # Already closed by the client
+
+
+class PendingPlaylistUpdate:
+    """Changes of one playlist waiting to be pushed, merged into a single delta while they are contiguous."""
+
+    def __init__(self, first_at: float):
+        self.first_at = first_at
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.prev_version: Optional[int] = None
+        self.version: Optional[int] = None
+        self.versioned = True  # Every change carried a version
+        self.contiguous = True  # Every change carried a delta following on the previous one
+        self.added: Dict[int, Dict[str, Any]] = {}
+        self.removed: Dict[int, None] = {}  # Ordered set of song ids
 
-    async def broadcast(self, message: str):
-        for connection in self.active_connections:
-            await connection.send_text(message)
+    def merge(self, version: Optional[int], added: Optional[Sequence[Any]], removed: Optional[Sequence[Any]]):
+        if version is None:
+            self.versioned = False
+            return
+        if (added is None and removed is None) or (self.version is not None and version != self.version + 1):
+            self.contiguous = False
+        if self.version is None:
+            self.prev_version = version - 1
+        self.version = version if self.version is None else max(self.version, version)
+        if not self.contiguous:
+            return
+
+        for song in removed or ():
+            # A song added earlier in the burst was not in the playlist at prev_version
+            if self.added.pop(song.id, None) is None:
+                self.removed[song.id] = None
+        for song in added or ():
+            self.added[song.id] = {field: getattr(song, field) for field in PLAYLIST_DELTA_SONG_FIELDS}
+
+    def message(self, playlist_id: int) -> Dict[str, Any]:
+        message: Dict[str, Any] = {"updated_playlist_id": playlist_id}
+        if self.versioned and self.version is not None:
+            message["version"] = self.version
+            if self.contiguous:
+                message["prev_version"] = self.prev_version
+                message["added"] = list(self.added.values())
+                message["removed"] = list(self.removed)
+        return message
+
+
+class PlaylistUpdateCoalescer:
+    """Debounces playlist updates per playlist, merging a burst of changes into one push."""
+
+    def __init__(self, window_seconds: float = PLAYLIST_UPDATE_WINDOW_SECONDS,
+                 max_delay_seconds: float = PLAYLIST_UPDATE_MAX_DELAY_SECONDS):
+        self.window_seconds = window_seconds
+        self.max_delay_seconds = max_delay_seconds
+        self._pending: Dict[int, PendingPlaylistUpdate] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    def add(self, playlist_id: int, version: Optional[int] = None,
+            added: Optional[Sequence[Any]] = None, removed: Optional[Sequence[Any]] = None):
+        loop = asyncio.get_running_loop()
+        pending = self._pending.get(playlist_id)
+        if pending is None:
+            pending = self._pending[playlist_id] = PendingPlaylistUpdate(loop.time())
+        else:
+            pending.timer.cancel()
+        pending.merge(version, added, removed)
+
+        push_at = min(loop.time() + self.window_seconds, pending.first_at + self.max_delay_seconds)
+        pending.timer = loop.call_at(push_at, self._schedule_push, playlist_id)
+
+    async def flush(self):
+        """Push every pending update right away, e.g. on shutdown."""
+        for playlist_id in list(self._pending):
+            await self._push(playlist_id)
+
+    def _schedule_push(self, playlist_id: int):
+        task = asyncio.create_task(self._push(playlist_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _push(self, playlist_id: int):
+        pending = self._pending.pop(playlist_id, None)
+        if pending is None:
+            return
+        pending.timer.cancel()
+        try:
+            await publish_playlist_update(pending.message(playlist_id))
+        except Exception as e:
+            print(f"Error pushing update of playlist {playlist_id}: {e!r}")
 
 
 # Chat connection manager with user-specific connections
@@ -36,6 +237,17 @@ class ChatWSConnectionManager:
         self.active_connections.pop(user_id, None)
 
     async def send_message(self, user_id: str, message: json):
+        """Send to the user's socket; if it is not connected to this worker, through the broker to the others."""
+        if user_id in self.active_connections:
+            await self.send_local_message(user_id, message)
+            return
+        payload = json.dumps({"user_id": user_id, "message": message})
+        if event_broker.fits(payload):
+            await event_broker.publish(CHAT_MESSAGES_CHANNEL, payload)
+        else:
+            print(f"Dropping chat message for user {user_id}: too large for the event broker.")
+
+    async def send_local_message(self, user_id: str, message: json):
         if user_id in self.active_connections:
             websocket = self.active_connections[user_id]["websocket"]
             await websocket.send_text(message)
@@ -50,11 +262,39 @@ class ChatWSConnectionManager:
 
 ws_manager_playlist = PlaylistWSConnectionManager()
 ws_manager_chat = ChatWSConnectionManager()
+playlist_update_coalescer = PlaylistUpdateCoalescer()
 
 # For notifying frontend clients to update local state of matching playlist
-async def ws_push_playlist_update(playlist_id: int = 1):
-    message = {"updated_playlist_id": playlist_id}
-    await ws_manager_playlist.broadcast(json.dumps(message))
+async def ws_push_playlist_update(playlist_id: int = 1, version: Optional[int] = None,
+                                  added: Optional[Sequence[Any]] = None, removed: Optional[Sequence[Any]] = None):
+    """Notify the clients of a playlist that it changed to `version`, by the songs `added` (appended in order)
+    and/or `removed` if given.
+
+    Changes are coalesced per playlist and pushed shortly after, as a delta from `prev_version` to `version`
+    that clients holding `prev_version` apply locally. Clients at any other version, or receiving an update
+    without a delta (non-contiguous changes, or changes without songs such as reorders), refetch the playlist
+    unless they already hold `version`.
+    """
+    playlist_update_coalescer.add(playlist_id, version, added, removed)
+
+async def publish_playlist_update(message: Dict[str, Any]):
+    payload = json.dumps(message)
+    if not event_broker.fits(payload):
+        # Too large for the broker: send the version only, clients refetch
+        payload = json.dumps({key: message[key] for key in ("updated_playlist_id", "version") if key in message})
+    await event_broker.publish(PLAYLIST_UPDATES_CHANNEL, payload)
+
+
+# Updates and messages from any worker (this one included) are delivered to the sockets of this worker
+def _deliver_playlist_update(payload: str):
+    ws_manager_playlist.publish(json.loads(payload)["updated_playlist_id"], payload)
+
+def _deliver_chat_message(payload: str):
+    event = json.loads(payload)
+    return ws_manager_chat.send_local_message(event["user_id"], event["message"])
+
+event_broker.subscribe(PLAYLIST_UPDATES_CHANNEL, _deliver_playlist_update)
+event_broker.subscribe(CHAT_MESSAGES_CHANNEL, _deliver_chat_message)
 
 def get_ws_manager_playlist() -> PlaylistWSConnectionManager:
     return ws_manager_playlist
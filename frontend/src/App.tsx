@@ -2,7 +2,7 @@ import React, { useCallback, useEffect, useRef, useState } from "react";
 import axios from "axios";
 import PlaylistComponent from "./components/Playlist";
 import SongListComponent from "./components/Songlist";
-import { Playlist, Song } from "./types";
+import { Playlist, PlaylistUpdateMessage, Song } from "./types";
 import './App.css'; 
 import CustomChatWidget from "./components/CustomChatWidget/CustomChatWidget";
 
@@ -15,50 +15,101 @@ const debounce = (func: Function, delay: number) => {
   };
 };
 
+// Reconnect delays of the playlist WebSocket, doubled after every failed attempt
+const RECONNECT_MIN_DELAY_MS = 1000;
+const RECONNECT_MAX_DELAY_MS = 30000;
+
 const App: React.FC = () => {
   const [playlist, setPlaylist] = useState<Playlist | null>(null);
   const playlistId = 1; // Static playlist ID for now
   const [searchTerm, setSearchTerm] = useState("");
   const [searchSongs, setSearchSongs] = useState<Song[]>([]);
   const playlistWS = useRef<WebSocket | null>(null);
+  const playlistRef = useRef<Playlist | null>(null); // Latest playlist for the WebSocket handler
+  const reconnectDelay = useRef(RECONNECT_MIN_DELAY_MS);
+  const reconnectTimer = useRef<ReturnType<typeof setTimeout> | null>(null);
+
+  useEffect(() => {
+    playlistRef.current = playlist;
+  }, [playlist]);
 
-  const establishPlaylistConnection = useCallback(() => {
+  const closePlaylistConnection = useCallback(() => {
+    if (reconnectTimer.current) {
+      clearTimeout(reconnectTimer.current);
+      reconnectTimer.current = null;
+    }
     if (playlistWS.current) {
-      playlistWS.current.close(); // Close existing connection if any
+      playlistWS.current.onclose = null; // Closed on purpose, do not reconnect
+      playlistWS.current.close();
+      playlistWS.current = null;
     }
-    playlistWS.current = new WebSocket("ws://localhost:8000/ws/playlist");
+  }, []);
 
-    playlistWS.current.onopen = () => {
+  const establishPlaylistConnection = useCallback((isReconnect: boolean = false) => {
+    closePlaylistConnection(); // Close existing connection if any
+    const ws = new WebSocket("ws://localhost:8000/ws/playlist");
+    playlistWS.current = ws;
+
+    ws.onopen = () => {
       console.log("Connected to playlist WebSocket");
+      reconnectDelay.current = RECONNECT_MIN_DELAY_MS;
+      // Only receive the updates of the displayed playlist
+      ws.send(JSON.stringify({ action: "subscribe", playlist_ids: [playlistId] }));
+      if (isReconnect) {
+        fetchPlaylist(); // Updates sent while disconnected were missed
+      }
     };
 
-    playlistWS.current.onmessage = (event) => {
+    ws.onmessage = (event) => {
       const message = event.data;
       console.log("Received from server:", message);
-      const updatedPlaylistId = JSON.parse(message).updated_playlist_id;
+      const update: PlaylistUpdateMessage = JSON.parse(message);
+      if (update.updated_playlist_id !== playlistId) {
+        return;
+      }
 
-      if (updatedPlaylistId === playlistId) {
-        console.log("Updating playlist...");
-        fetchPlaylist();
+      const current = playlistRef.current;
+      if (current && update.version !== undefined && current.version === update.version) {
+        return; // Already up to date
       }
+      if (current && update.prev_version !== undefined && current.version === update.prev_version) {
+        // Apply the delta locally instead of refetching the playlist; songs already shown are not added twice
+        const removed = new Set(update.removed ?? []);
+        const kept = current.songs.filter((song) => !removed.has(song.id));
+        const present = new Set(kept.map((song) => song.id));
+        const updated = {
+          ...current,
+          version: update.version!,
+          songs: [...kept, ...(update.added ?? []).filter((song) => !present.has(song.id))],
+        };
+        playlistRef.current = updated;
+        setPlaylist(updated);
+        return;
+      }
+
+      // Missed an update (or no delta): fetch the whole playlist
+      console.log("Updating playlist...");
+      fetchPlaylist();
     };
 
-    playlistWS.current.onclose = () => {
-      console.log("Disconnected from playlist WebSocket");
+    ws.onclose = (event) => {
+      // The server also closes slow consumers (code 1013), which should come back and catch up
+      const delay = reconnectDelay.current;
+      console.log(`Disconnected from playlist WebSocket (code ${event.code}), reconnecting in ${delay} ms`);
+      reconnectDelay.current = Math.min(delay * 2, RECONNECT_MAX_DELAY_MS);
+      reconnectTimer.current = setTimeout(() => establishPlaylistConnection(true), delay);
     };
-  }, [playlistId]);
+  }, [playlistId, closePlaylistConnection]);
 
   useEffect(() => {
     fetchPlaylist();
     establishPlaylistConnection();
 
-    return () => {
-      playlistWS.current?.close();
-    };
-  }, [establishPlaylistConnection]);
+    return closePlaylistConnection;
+  }, [establishPlaylistConnection, closePlaylistConnection]);
 
   const reconnectAll = useCallback(() => {
-    establishPlaylistConnection();
+    establishPlaylistConnection(true);
   }, [establishPlaylistConnection]);
 
   // Memoize the debounced search function
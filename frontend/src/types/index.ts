@@ -11,5 +11,15 @@ export interface Song {
 export interface Playlist {
   id: number;
   title: string;
+  version: number;
   songs: Song[];
 }
+
+// Pushed on the playlist WebSocket; added/removed form a delta from prev_version to version when present
+export interface PlaylistUpdateMessage {
+  updated_playlist_id: number;
+  version?: number;
+  prev_version?: number;
+  added?: Song[];
+  removed?: number[];
+}